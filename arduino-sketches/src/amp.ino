@@ -36,6 +36,12 @@
 /// - L0, L1: alliance low light off or on
 /// - H0, H1, HB: alliance high light off, on, blink
 /// - C0, C1, CB: coopertition high light off, on, blink
+///
+/// = protocol v2 from server
+/// - the same commands, batched into acknowledged frames; see common-net.ino.
+///
+/// = multicast from server
+/// - field state datagram; see common-net.ino. Carries the same L, H and C values.
 
 #define IS_RED_ALLIANCE true
 
@@ -104,6 +110,22 @@ bool update_lit_state(char val) {
   return val == '1';
 }
 
+/// Apply a light command from the server to the amp state
+void apply_command(const char* input) {
+  switch(input[0]) {
+    case 'L':
+      g_amp_state.low_light_lit = update_lit_state(input[1]);
+      break;
+    case 'H':
+      g_amp_state.high_light_lit = update_lit_state(input[1]);
+      g_amp_state.alliance_light_blink = input[1] == 'B';
+      break;
+    case 'C':
+      g_amp_state.coopertition_light_lit = update_lit_state(input[1]);
+      g_amp_state.coopertition_light_blink = input[1] == 'B';
+  }
+}
+
 void loop() {
   unsigned long current_time = millis();
 
@@ -144,29 +166,24 @@ void loop() {
     g_comms->write("C\r\n");
   }
   if (note_sensor_triggered) {
-    g_comms->write("RA\r\n");
+    send_sensor_event("RA", current_time);
   }
   if (manual_speaker_score_triggered) {
-    g_comms->write("RS\r\n");
+    send_sensor_event("RS", current_time);
   }
 
-  // Read light state from the server
-  char* input = g_comms->input();
-
-  if (input == nullptr) {
-    return;
+  // Read light state from the server, via multicast field state or direct command
+  const byte* field_state = g_comms->field_state(IS_RED_ALLIANCE);
+  if (field_state != nullptr) {
+    char command[3] = {'L', (char)field_state[0], '\0'};
+    apply_command(command);
+    command[0] = 'H';
+    command[1] = field_state[1];
+    apply_command(command);
+    command[0] = 'C';
+    command[1] = field_state[2];
+    apply_command(command);
   }
 
-  switch(input[0]) {
-    case 'L':
-      g_amp_state.low_light_lit = update_lit_state(input[1]);
-      break;
-    case 'H':
-      g_amp_state.high_light_lit = update_lit_state(input[1]);
-      g_amp_state.alliance_light_blink = input[1] == 'B';
-      break;
-    case 'C':
-      g_amp_state.coopertition_light_lit = update_lit_state(input[1]);
-      g_amp_state.coopertition_light_blink = input[1] == 'B';
-  }
+  receive_commands();
 }
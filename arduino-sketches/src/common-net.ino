@@ -6,21 +6,38 @@
 /// - every message ends with \r\n
 ///
 /// = init
-/// - this client sends 'HRA' or 'HBA' depending on if it's red or blue alliance
-/// - server responds with OK or NO
+/// - this client sends 'HRA2' or 'HBA2' depending on if it's red or blue alliance
+///   (the trailing 2 offers protocol v2)
+/// - server responds with OK2 (use v2), OK (use v1) or NO
 ///   - on NO, light only top alliance light solid and park in error state; must reboot
 ///
 /// = outbound to server
 /// - A: alliance button pressed
 /// - C: coopertition button pressed
-/// - R: Ring sensor tripped
+/// - RA, RS: Ring sensor tripped (amp, speaker); on v2, followed by millis() when
+///   it tripped as 8 hex digits, e.g. RA0001D4C0
 ///
 /// = inbound from server
 /// - L0, L1: alliance low light off or on
 /// - H0, H1, HB: alliance high light off, on, blink
 /// - C0, C1, CB: coopertition high light off, on, blink
+///
+/// = protocol v2
+/// - server sends several commands per line as a frame:
+///   F, sequence (2 hex digits), command count (1 hex digit), then the two-character commands
+/// - after applying a frame, this client sends K, the frame's sequence (2 hex digits)
+///   and millis() (8 hex digits); the server uses these to line up our clock with its own
+/// - TS (clock sync) is sent alone in a frame just to get an ack; it needs no handling
+///
+/// = multicast field state (optional, server run with --multicast)
+/// - 14-byte UDP datagram: 'F', epoch, 32-bit big-endian sequence number, then
+///   four value characters per alliance (red first): amp low light, amp high
+///   light, coopertition light, speaker amp level
+/// - each value is the second character of the equivalent TCP command above
+/// - only datagrams newer than the last one applied are used
 
 #include <Ethernet.h>
+#include <EthernetUdp.h>
 
 /// Remote connection configs
 
@@ -31,6 +48,13 @@
 const IPAddress field_server_ip(10,0,1,1);
 const int server_port = 8008;
 
+const IPAddress field_state_group(239,0,1,1);
+const int field_state_port = 8009;
+
+#define FIELD_STATE_SIZE 14
+#define FIELD_STATE_HEADER_SIZE 6
+#define FIELD_STATE_SLOTS 4
+
 class TextBuffer {
 private:
   size_t m_cursor;
@@ -61,10 +85,66 @@ public:
 
 #if USE_ETHERNET
 
+class FieldStateListener {
+private:
+  EthernetUDP m_udp;
+  byte m_packet[FIELD_STATE_SIZE];
+  byte m_state[FIELD_STATE_SIZE];
+  bool m_have_state;
+  byte m_epoch;
+  unsigned long m_sequence;
+
+public:
+  FieldStateListener(): m_have_state(false), m_epoch(0), m_sequence(0) {}
+
+  ~FieldStateListener() {
+    m_udp.stop();
+  }
+
+  void begin() {
+    m_udp.beginMulticast(field_state_group, field_state_port);
+  }
+
+  // Drain all pending datagrams. If any of them is newer than the last one applied,
+  // return a pointer to the FIELD_STATE_SLOTS value characters for the given alliance
+  // from the newest one. Otherwise, return nullptr.
+  const byte* input(bool red_alliance) {
+    bool updated = false;
+    for (int size = m_udp.parsePacket(); size > 0; size = m_udp.parsePacket()) {
+      if (size != FIELD_STATE_SIZE) {
+        continue;
+      }
+      m_udp.read(m_packet, FIELD_STATE_SIZE);
+      if (m_packet[0] != 'F') {
+        continue;
+      }
+      unsigned long sequence =
+        ((unsigned long)m_packet[2] << 24) |
+        ((unsigned long)m_packet[3] << 16) |
+        ((unsigned long)m_packet[4] << 8) |
+        (unsigned long)m_packet[5];
+      // A new epoch means the server restarted; otherwise, ignore anything not newer (wraparound-safe).
+      if (m_have_state && m_packet[1] == m_epoch && (long)(sequence - m_sequence) <= 0) {
+        continue;
+      }
+      memcpy(m_state, m_packet, FIELD_STATE_SIZE);
+      m_have_state = true;
+      m_epoch = m_packet[1];
+      m_sequence = sequence;
+      updated = true;
+    }
+    if (!updated) {
+      return nullptr;
+    }
+    return m_state + FIELD_STATE_HEADER_SIZE + (red_alliance ? 0 : FIELD_STATE_SLOTS);
+  }
+};
+
 class EthernetComms {
   private:
     TextBuffer m_buffer;
     EthernetClient m_client;
+    FieldStateListener m_field_state;
     IPAddress m_field_server_ip;
     int m_port;
     bool m_connected;
@@ -75,8 +155,9 @@ class EthernetComms {
       const IPAddress& my_ip,
       const IPAddress& field_server_ip,
       const int port):
-      m_buffer(), m_client(), m_field_server_ip(field_server_ip), m_port(port), m_connected(false) {
+      m_buffer(), m_client(), m_field_state(), m_field_server_ip(field_server_ip), m_port(port), m_connected(false) {
       Ethernet.begin((uint8_t*)mac, my_ip);
+      m_field_state.begin();
       }
 
 
@@ -96,6 +177,11 @@ class EthernetComms {
       return nullptr;
     }
 
+    // Newest multicast field state slots for the alliance, or nullptr if nothing new
+    const byte* field_state(bool red_alliance) {
+      return m_field_state.input(red_alliance);
+    }
+
     void write(const char* out) {
 
       for (size_t cursor = 0; out[cursor] != '\0' && cursor < 80; ++cursor) {
@@ -153,6 +239,11 @@ public:
     return nullptr;
   }
 
+  // Multicast field state is not available over serial.
+  const byte* field_state(bool red_alliance) {
+    return nullptr;
+  }
+
   // Write out a null-terminated string to serial comms
   void write(const char* out) {
     for (size_t cursor = 0; out[cursor] != '\0' && cursor < 80; ++cursor) {
@@ -179,6 +270,76 @@ void debug_msg(const char* msg) {
 
 Comms* g_comms = nullptr;
 
+// Protocol version agreed with the server at handshake (1 or 2).
+int g_protocol_version = 1;
+
+// Each sketch applies individual server commands (e.g. "L1") here.
+void apply_command(const char* input);
+
+// Value of a hex digit, or -1 if c is not one.
+int hex_digit(char c) {
+  if (c >= '0' && c <= '9') {
+    return c - '0';
+  }
+  if (c >= 'A' && c <= 'F') {
+    return c - 'A' + 10;
+  }
+  return -1;
+}
+
+// Write `value` as `digits` uppercase hex digits, most significant first.
+void write_hex(char* out, unsigned long value, int digits) {
+  for (int i = digits - 1; i >= 0; --i) {
+    out[i] = "0123456789ABCDEF"[value & 0xF];
+    value >>= 4;
+  }
+}
+
+// Report a sensor event (e.g. "RA") that happened at millis() `when`.
+// On protocol v2 the event carries `when`, so the server can score it by when it happened.
+void send_sensor_event(const char* event, unsigned long when) {
+  char out[13] = {event[0], event[1]};
+  int cursor = 2;
+  if (g_protocol_version == 2) {
+    write_hex(out + cursor, when, 8);
+    cursor += 8;
+  }
+  out[cursor++] = '\r';
+  out[cursor++] = '\n';
+  out[cursor] = '\0';
+  g_comms->write(out);
+}
+
+// Read a line from the server, if one is ready, and apply it.
+// Protocol v2 frames are applied command by command and then acknowledged.
+void receive_commands() {
+  char* input = g_comms->input();
+
+  if (input == nullptr) {
+    return;
+  }
+
+  if (g_protocol_version == 2 && input[0] == 'F') {
+    int count = hex_digit(input[3]);
+    if (count < 0 || strlen(input) < (size_t)(4 + 2 * count)) {
+      debug_msg("Malformed frame; ignoring.");
+      return;
+    }
+    for (int i = 0; i < count; ++i) {
+      apply_command(input + 4 + 2 * i);
+    }
+    char ack[14] = {'K', input[1], input[2]};
+    write_hex(ack + 3, millis(), 8);
+    ack[11] = '\r';
+    ack[12] = '\n';
+    ack[13] = '\0';
+    g_comms->write(ack);
+    return;
+  }
+
+  apply_command(input);
+}
+
 // Configure mac address based on the alliance string.
 // On return, mac_address is populated with new address.
 // NOTE: mac_address should be a 6-byte array.
@@ -234,7 +395,9 @@ IPAddress select_client_ip(const char* alliance_string) {
 /// - HRA\r\n: "Hello, red amp"
 /// - HBS\r\n: "Hello, blue speaker"
 /// - HRS\r\n: "Hello, red speaker"
+/// The hello actually sent also offers protocol v2.
 void establishConnection(const char* msg) {
+  char hello[7] = {msg[0], msg[1], msg[2], '2', '\r', '\n', '\0'};
 
   byte mac[6];
 
@@ -251,7 +414,7 @@ void establishConnection(const char* msg) {
       debug_msg("Unable to connect; retrying.");
       continue;
     }
-    g_comms->write(msg);
+    g_comms->write(hello);
 
     char* input = g_comms->input();
     // Wait for response from server
@@ -260,6 +423,7 @@ void establishConnection(const char* msg) {
       delay(500);
     }
     if (input[0] == 'O' && input[1] == 'K') {
+      g_protocol_version = input[2] == '2' ? 2 : 1;
       debug_msg("Connected!");
       return;
     }
@@ -26,7 +26,16 @@ uint32_t g_off_color = g_neo_pixel.Color(0,0,0);
 void setup() {
   g_neo_pixel.begin();
 
-  establishConnection(RED_ALLIANCE ? "HBS\r\n" : "HRS\r\n");
+  establishConnection(RED_ALLIANCE ? "HRS\r\n" : "HBS\r\n");
+}
+
+/// Apply a light command from the server to the speaker state
+void apply_command(const char* input) {
+  switch(input[0]) {
+    case 'A':
+      g_speaker_state.amp_level = input[1] == 'A' ? 10 : input[1] - '0';
+      break;
+  }
 }
 
 void loop() {
@@ -34,7 +43,7 @@ void loop() {
   delay(50);
 
   if (!g_comms->connected()) {
-    establishConnection(RED_ALLIANCE ? "HBS\r\n" : "HRS\r\n");
+    establishConnection(RED_ALLIANCE ? "HRS\r\n" : "HBS\r\n");
   }
 
   int lit_pixels = g_speaker_state.amp_level * NUM_NEOPIXELS / 10;
@@ -46,16 +55,12 @@ void loop() {
   g_neo_pixel.show();
 
 
-  // Read light state from the server
-  char* input = g_comms->input();
-
-  if (input == nullptr) {
-    return;
+  // Read light state from the server, via multicast field state or direct command
+  const byte* field_state = g_comms->field_state(RED_ALLIANCE);
+  if (field_state != nullptr) {
+    char command[3] = {'A', (char)field_state[3], '\0'};
+    apply_command(command);
   }
 
-  switch(input[0]) {
-    case 'A':
-      g_speaker_state.amp_level = input[1] == 'A' ? 10 : input[1] - '0';
-      break;
-  }
+  receive_commands();
 }
@@ -5,9 +5,14 @@ import telnetlib3
 
 logger = logging.getLogger(__name__)
 
+from frc_2024_field_server.broadcast import DEFAULT_MULTICAST_GROUP, DEFAULT_MULTICAST_PORT, FieldStateBroadcaster
 from frc_2024_field_server.clients import Clients
 from frc_2024_field_server.game.state import GameState
-from frc_2024_field_server.game.loop import game_loop
+from frc_2024_field_server.game.loop import game_loop, MAIN_PERIOD_MSEC
+from frc_2024_field_server.logs import parse_levels, start_logging, stop_logging
+from frc_2024_field_server.profiling import Profiler
+from frc_2024_field_server.tracing import DEFAULT_TRACE_PATH, Tracer
+from frc_2024_field_server.shared_state import DEFAULT_PATH as DEFAULT_SHARED_STATE_PATH, SharedStatePublisher
 from frc_2024_field_server.ui import UI
 
 state = GameState()
@@ -23,22 +28,62 @@ async def server(reader, writer):
             await writer.drain()
 
 def run() -> None:
-    logging.basicConfig()
-
     argparser = argparse.ArgumentParser(
         prog='frc-2024-field-server',
         description='Server for field element controller in FRC 2024 field.',
     )
     argparser.add_argument('--host', default='127.0.0.1', help='Hostname to listen on.')
     argparser.add_argument('--port', default=23, type=int, help='Port to listen on.')
+    argparser.add_argument('--multicast', action='store_true',
+                           help='Send field display state via UDP multicast instead of per-client TCP.')
+    argparser.add_argument('--multicast-group', default=DEFAULT_MULTICAST_GROUP,
+                           help='Multicast group to send field state to.')
+    argparser.add_argument('--multicast-port', default=DEFAULT_MULTICAST_PORT, type=int,
+                           help='Port to send multicast field state to.')
+    argparser.add_argument('--profile', nargs='?', const='field-profile', default=None, metavar='PREFIX',
+                           help='Profile the event loop and report slow steps; output files start with PREFIX.')
+    argparser.add_argument('--shared-state', nargs='?', const=DEFAULT_SHARED_STATE_PATH, default=None, metavar='PATH',
+                           help=f'Publish game state to a memory-mapped file for overlays (default {DEFAULT_SHARED_STATE_PATH}).')
+    argparser.add_argument('--trace', nargs='?', const=0.01, default=None, type=float, metavar='RATE',
+                           help='Trace latency of this fraction of element inputs (default 0.01).')
+    argparser.add_argument('--trace-file', default=DEFAULT_TRACE_PATH, help='File to write traces to, as JSON lines.')
+    argparser.add_argument('--log-level', action='append', default=[], metavar='[LOGGER=]LEVEL',
+                           help=('Log level, for all loggers or for one subsystem '
+                                 '(e.g. frc_2024_field_server.game.loop=DEBUG). May be repeated.'))
     args = argparser.parse_args()
 
+    log_listener = start_logging(parse_levels(args.log_level))
+
     loop = asyncio.get_event_loop()
 
-    loop.create_task(game_loop(state, clients))
-    loop.create_task(ui.update())
-    loop.run_until_complete(
-        telnetlib3.run_server(port=args.port, host=args.host, shell=clients.new_connection_shell))
+    profiler: Profiler | None = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile, MAIN_PERIOD_MSEC)
+        profiler.start(loop)
+
+    if args.multicast:
+        clients.broadcaster = FieldStateBroadcaster(args.multicast_group, args.multicast_port, args.host)
+        loop.run_until_complete(clients.broadcaster.open())
+
+    if args.trace is not None:
+        clients.tracer = Tracer(args.trace, args.trace_file)
+        clients.tracer.start()
+
+    publisher = SharedStatePublisher(args.shared_state) if args.shared_state is not None else None
+
+    loop.create_task(game_loop(state, clients, publisher), name='game_loop')
+    loop.create_task(ui.update(), name='UI.update')
+    try:
+        loop.run_until_complete(
+            telnetlib3.run_server(port=args.port, host=args.host, shell=clients.new_connection_shell,
+                                  # run_server resets the root log level; keep the one we configured.
+                                  loglevel=logging.getLevelName(logging.getLogger().level)))
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if clients.tracer is not None:
+            clients.tracer.stop()
+        stop_logging(log_listener)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import socket
+import struct
+import time
+from frc_2024_field_server.message_receiver import Alliance, FieldElement
+from typing import Final
+
+"""UDP multicast broadcast of the complete field display state.
+
+Every datagram carries the full display state of all four field elements, so an
+element only ever needs the newest one it has seen. Layout (14 bytes):
+
+  0:     'F' (magic)
+  1:     epoch (random per server run, so a server restart resets sequencing)
+  2-5:   sequence number, unsigned 32-bit big-endian (see SEQUENCE_CLOCK_HZ)
+  6-9:   red alliance slots: amp low, amp high, amp coopertition, speaker amp level
+  10-13: blue alliance slots: same as red
+
+Each slot holds the value character of the equivalent TCP command (e.g. the
+'1' of 'L1', the 'B' of 'CB').
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MULTICAST_GROUP: Final = '239.0.1.1'
+DEFAULT_MULTICAST_PORT: Final = 8009
+REFRESH_PERIOD_NS: Final = 250_000_000
+
+# Sequence numbers follow the wall clock at this rate, and only count on by one
+# if datagrams go out faster. At most one goes out per game loop tick, so a
+# restarted server carries on ahead of where the last run stopped; elements
+# that missed the restart don't drop its datagrams even if the epoch repeats.
+SEQUENCE_CLOCK_HZ: Final = 100
+
+MAGIC: Final = b'F'
+HEADER_FORMAT: Final = '!ccI'
+
+# Command letter each slot carries, per field element, in datagram order.
+SLOT_COMMANDS: Final = (
+    (FieldElement.AMP, 'L'),
+    (FieldElement.AMP, 'H'),
+    (FieldElement.AMP, 'C'),
+    (FieldElement.SPEAKER, 'A'),
+)
+
+SLOTS_PER_ALLIANCE: Final = len(SLOT_COMMANDS)
+
+SLOT_INDEX: Final = {key: index for index, key in enumerate(SLOT_COMMANDS)}
+
+
+class FieldStateBroadcaster:
+    """Multicasts sequence-numbered field display state to all elements at once."""
+
+    def __init__(self, group: str, port: int = DEFAULT_MULTICAST_PORT, interface: str | None = None):
+        self._group = group
+        self._port = port
+        self._interface = interface
+        self._transport: asyncio.DatagramTransport | None = None
+        self._epoch = random.randrange(256)
+        self._sequence = 0
+        self._slots = bytearray(b'0' * (SLOTS_PER_ALLIANCE * len(Alliance)))
+        self._dirty = True
+        self._last_send_ns = 0
+
+    async def open(self) -> None:
+        """Open the multicast socket."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        if self._interface is not None:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self._interface))
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, sock=sock)
+        logger.info("Broadcasting field state to %s:%d", self._group, self._port)
+
+    def update(self, alliance: Alliance, element: FieldElement, message: str) -> bool:
+        """Record a display command in the field state.
+
+        Return:
+          True if the command maps onto the field state, False if it must go over TCP.
+        """
+        index = SLOT_INDEX.get((element, message[:1]))
+        if index is None or len(message) != 2:
+            return False
+
+        offset = alliance * SLOTS_PER_ALLIANCE + index
+        value = ord(message[1])
+        if self._slots[offset] != value:
+            self._slots[offset] = value
+            self._dirty = True
+        return True
+
+    def flush(self, cur_time_ns: int) -> None:
+        """Send the field state if it changed or the refresh period has elapsed."""
+        if self._transport is None:
+            return
+        if not self._dirty and cur_time_ns - self._last_send_ns < REFRESH_PERIOD_NS:
+            return
+
+        self._sequence = max(self._sequence + 1, int(time.time() * SEQUENCE_CLOCK_HZ))
+        self._transport.sendto(self.encode(), (self._group, self._port))
+        self._dirty = False
+        self._last_send_ns = cur_time_ns
+
+    def sent(self) -> bool:
+        """True if the current field state has been sent.
+
+        Multicast has no acknowledgements, so this is as close to "in sync" as
+        the field state gets.
+        """
+        return self._transport is not None and not self._dirty
+
+    def encode(self) -> bytes:
+        """Encode the current field state as a datagram."""
+        return struct.pack(HEADER_FORMAT, MAGIC, bytes((self._epoch,)), self._sequence & 0xFFFFFFFF) + bytes(self._slots)
+
+    def close(self) -> None:
+        """Close the multicast socket."""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
@@ -2,12 +2,19 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 import asyncio
+from collections import OrderedDict
 from enum import Enum, auto
 import logging
+import time
+from frc_2024_field_server.clock import ElementClock
+from frc_2024_field_server.elements import ElementId
+from frc_2024_field_server.logs import fields
 from frc_2024_field_server.game.state import GameState
-from frc_2024_field_server.message_receiver import Alliance, FieldElement, Receiver, Message
+from frc_2024_field_server.message_receiver import Receiver, Message
+from frc_2024_field_server import protocol
+from frc_2024_field_server.tracing import OutputSpan, Tracer, current_trace
 from telnetlib3 import TelnetReader,TelnetWriter
-from typing import Literal
+from typing import Final, Literal
 
 """An individual client."""
 
@@ -18,10 +25,13 @@ class Datasource(Enum):
 
 logger = logging.getLogger(__name__)
 
+# Sensor times further back than this are not trusted; the input is timed on arrival instead.
+MAX_SENSOR_AGE_NS: Final[int] = 5_000_000_000
+
 class ClientException(Exception):
     """An exception that occurs inside a client. Carries the client itself with it."""
     def __init__(self, client: Client):
-        super().__init__(f"Exception raised from client [{client.alliance.name} | {client.field_element.name}]")
+        super().__init__(f"Exception raised from client [{client.element_id.name}]")
         self.client = client
 
 class ClientClosedException(Exception):
@@ -31,20 +41,40 @@ class ClientClosedException(Exception):
 class Client(ABC):
     """An individual client connection."""
 
-    def __init__(self, alliance: Alliance, element: FieldElement, receiver: Receiver):
-        self.alliance = alliance
-        self.field_element = element
+    def __init__(self, element_id: ElementId, receiver: Receiver, protocol_version: int = protocol.PROTOCOL_V1):
+        self.element_id = element_id
+        self.alliance = element_id.alliance
+        self.field_element = element_id.element
         self.receiver = receiver
-        self.output_queue = asyncio.Queue()
+        # (message, span if the message was caused by a traced input)
+        self.output_queue: asyncio.Queue[tuple[str, OutputSpan | None]] = asyncio.Queue()
+        # commands queued by output() that haven't been written yet
+        self._unsent_commands = 0
+        self.protocol_version = protocol_version
+        self._next_sequence = 0
+        # v2 frames sent but not yet acknowledged: sequence -> send time in ns
+        self.unacked_frames: OrderedDict[int, int] = OrderedDict()
+        self.last_round_trip_ns = 0
+        self.last_frame_sent_ns = 0
+        # unacked frames that carry only CLOCK_SYNC_COMMAND
+        self._clock_sync_frames: set[int] = set()
+        self.clock = ElementClock()
+        self.tracer: Tracer | None = None
 
     async def shell(self, reader:TelnetReader, writer:TelnetWriter)-> None:
         """Processing shell for handling transactions between client and game."""
+        tasks = [asyncio.create_task(self.await_client_input_shell(reader)),
+                 asyncio.create_task(self.await_server_output_shell(writer)),
+                 asyncio.create_task(self.await_telnet_stream_monitor(reader, writer))]
         try:
-            await asyncio.gather(self.await_client_input_shell(reader),
-                                self.await_server_output_shell(writer),
-                                self.await_telnet_stream_monitor(reader, writer))
+            await asyncio.gather(*tasks)
         except Exception as e:
             raise ClientException(self) from e
+        finally:
+            # gather leaves the other sub-tasks running when one fails; they would
+            # otherwise wait forever on a dead connection.
+            for task in tasks:
+                task.cancel()
 
     async def await_client_input_shell(self, reader:TelnetReader) -> None:
         """Sub-task to await for client input."""
@@ -52,15 +82,114 @@ class Client(ABC):
             if reader.connection_closed:
                 raise ClientClosedException()
             incoming: str = await reader.readline()
-            self.handle_input(incoming)
+            if self.protocol_version == protocol.PROTOCOL_V2 and incoming.startswith(protocol.ACK_START):
+                self.handle_ack(incoming)
+            elif self.tracer is not None:
+                token = current_trace.set(self.tracer.sample(self.element_id, incoming))
+                try:
+                    self.handle_input(incoming)
+                finally:
+                    current_trace.reset(token)
+            else:
+                self.handle_input(incoming)
 
     async def await_server_output_shell(self, writer: TelnetWriter) -> None:
         """Sub-task to await for server output."""
         while True:
             if writer.connection_closed:
                 raise ClientClosedException()
-            outgoing = await self.output_queue.get()
-            writer.write(f'{outgoing}\r\n')
+            # Send everything queued so far in one write, as one frame on v2.
+            queued = [await self.output_queue.get()]
+            while not self.output_queue.empty() and len(queued) < protocol.MAX_FRAME_COMMANDS:
+                queued.append(self.output_queue.get_nowait())
+
+            spans = [span for _, span in queued if span is not None]
+            for span in spans:
+                span.mark_dequeued()
+            writer.write(self.encode_output([msg for msg, _ in queued]))
+            self._unsent_commands -= sum(msg != protocol.CLOCK_SYNC_COMMAND for msg, _ in queued)
+            # write() only buffers; the frame has left once the transport takes it.
+            await writer.drain()
+            for span in spans:
+                span.mark_written()
+
+    def encode_output(self, outgoing: list[str]) -> str:
+        """Encode queued messages for the wire, recording sent frames on v2."""
+        if self.protocol_version != protocol.PROTOCOL_V2:
+            return ''.join(f'{msg}\r\n' for msg in outgoing)
+
+        sequence = self._next_sequence
+        self._next_sequence = (sequence + 1) % protocol.SEQUENCE_MODULUS
+        self.last_frame_sent_ns = time.monotonic_ns()
+        self.unacked_frames.pop(sequence, None)
+        self.unacked_frames[sequence] = self.last_frame_sent_ns
+        if outgoing == [protocol.CLOCK_SYNC_COMMAND]:
+            self._clock_sync_frames.add(sequence)
+        else:
+            self._clock_sync_frames.discard(sequence)
+        return f'{protocol.encode_frame(sequence, outgoing)}\r\n'
+
+    def handle_ack(self, inp: str) -> None:
+        """Handle a v2 ack. Acks arrive in order, so this also acks all earlier frames.
+
+        An ack carrying the element's clock is also a sample for its clock estimate.
+        """
+        received_ns = time.monotonic_ns()
+        try:
+            sequence = protocol.decode_ack(inp)
+        except protocol.ProtocolException:
+            logger.warning("Ignoring malformed ack", extra=fields(element=self.element_id.name, input=inp.strip()))
+            return
+        if sequence not in self.unacked_frames:
+            logger.warning("Ack for unknown frame %02X from %s", sequence, self.element_id.name)
+            return
+        while self.unacked_frames:
+            acked, sent_ns = self.unacked_frames.popitem(last=False)
+            self._clock_sync_frames.discard(acked)
+            if acked == sequence:
+                self.last_round_trip_ns = received_ns - sent_ns
+                element_ms = protocol.decode_ack_clock(inp)
+                if element_ms is not None:
+                    self.clock.add_sample(sent_ns, received_ns, element_ms)
+                return
+
+    def in_sync(self) -> bool:
+        """True if everything queued for the element has been sent and confirmed.
+
+        On v1, which has no acknowledgements, true once it has been sent.
+        Clock sync frames don't count; they change nothing on the element.
+        """
+        return self._unsent_commands == 0 and self.unacked_frames.keys() <= self._clock_sync_frames
+
+    def sync_clock(self, now_ns: int) -> None:
+        """Send a clock sync frame if nothing has been sent to the element lately.
+
+        Also sent while frames are unacknowledged: if their ack was lost or
+        malformed, the sync frame's ack acknowledges them too.
+        """
+        if (self.protocol_version == protocol.PROTOCOL_V2
+                and now_ns - self.last_frame_sent_ns > protocol.CLOCK_SYNC_PERIOD_NS):
+            self.output_queue.put_nowait((protocol.CLOCK_SYNC_COMMAND, None))
+
+    def sensor_time_ns(self, inp: str) -> int:
+        """When a timestamped sensor input happened, in server time, or 0 if unknown.
+
+        Args:
+          inp: Sensor input line, e.g. 'RA0001D4C0'.
+        """
+        element_ms = protocol.decode_event_clock(inp)
+        if element_ms is None:
+            return 0
+        now_ns = time.monotonic_ns()
+        when_ns = self.clock.to_server_ns(element_ms, now_ns)
+        if when_ns is None:
+            return 0
+        if now_ns - when_ns > MAX_SENSOR_AGE_NS:
+            logger.warning("Sensor time from %s is %.1fs old; timing it on arrival",
+                           self.element_id.name, (now_ns - when_ns) / 1e9)
+            return 0
+        # The estimate can put an event a little in the future; it can't have happened after it arrived.
+        return min(when_ns, now_ns)
 
     async def await_telnet_stream_monitor(self, reader: TelnetReader, writer: TelnetWriter) -> None:
         """Active monitoring for connection closure.
@@ -72,13 +201,17 @@ class Client(ABC):
                 raise ClientClosedException("Writer closed.")
             if reader.connection_closed:
                 raise ClientClosedException("Reader closed.")
+            self.sync_clock(time.monotonic_ns())
 
             await asyncio.sleep(0.5)
 
 
     async def output(self, msg: str) -> None:
         """Output a message to the connected client."""
-        await self.output_queue.put(msg)
+        trace = current_trace.get()
+        span: OutputSpan | None = trace.add_output(self.element_id, msg) if trace is not None else None
+        self._unsent_commands += 1
+        await self.output_queue.put((msg, span))
 
     @abstractmethod
     def handle_input(self, inp: str) -> None:
@@ -88,9 +221,9 @@ class Client(ABC):
     async def send_init_state(self, state: GameState) -> None:
         """Sends initial configuration to a newly-connected client."""
 
-    def report_unknown_input(self, inp: bytes) -> None:
+    def report_unknown_input(self, inp: str) -> None:
         """Utility function used by inheriting classes: reports unknown inputs."""
-        logger.error("Unknown client input %s", inp)
+        logger.error("Unknown client input", extra=fields(element=self.element_id.name, input=inp.strip()))
 
     def send_message(self, message: Message) -> None:
         """Utility function used by inheriting classes. Send a message to my receiver."""
@@ -1,8 +1,13 @@
+from frc_2024_field_server.broadcast import FieldStateBroadcaster
 from frc_2024_field_server.client import Client, ClientException
+from frc_2024_field_server.elements import ElementGroup, ElementId, REQUIRED_ELEMENTS, group_for
 from frc_2024_field_server.game.clients import new_client
 from frc_2024_field_server.message_receiver import Alliance, FieldElement, Message, Receiver
+from frc_2024_field_server.protocol import decode_protocol_version, handshake_response
+from frc_2024_field_server.tracing import Trace, Tracer, current_trace
 from dataclasses import dataclass
 import logging
+from frc_2024_field_server.logs import fields
 from telnetlib3 import TelnetReader, TelnetWriter
 
 """Collection of all clients and communicatoin tools to interact with them."""
@@ -15,16 +20,40 @@ class ClientMessage:
     alliance: Alliance
     field_element: FieldElement
     message: Message
+    trace: Trace | None = None
 
 class Clients(Receiver):
-    def __init__(self):
-        self.clients: list[list[Client|None]] = [[None,None],[None,None]]
+    def __init__(self, broadcaster: FieldStateBroadcaster | None = None):
+        self.clients: dict[ElementId, Client] = {}
+        # Connected members of each group sent to so far; rebuilt when clients come and go.
+        self._group_members: dict[ElementGroup, list[Client]] = {}
         self._messages: list[ClientMessage] = []
         self.new_clients: list[Client] = []
-
-    def connect(self, alliance: Alliance, element: FieldElement, client: Client) -> None:
-        """Connect a client to the set of clients."""
-        self.clients[alliance][element] = client
+        self.broadcaster = broadcaster
+        self.tracer: Tracer | None = None
+
+    def connect(self, client: Client) -> None:
+        """Connect a client to the set of clients, replacing any previous client for that element."""
+        self.clients[client.element_id] = client
+        self._group_members.clear()
+
+    def disconnect(self, client: Client) -> None:
+        """Remove a client from the set of clients, if it is still the current one for its element."""
+        if self.clients.get(client.element_id) is client:
+            del self.clients[client.element_id]
+            self._group_members.clear()
+
+    def get(self, element_id: ElementId) -> Client | None:
+        """Get the client for an element, or None if it isn't connected."""
+        return self.clients.get(element_id)
+
+    def members(self, group: ElementGroup) -> list[Client]:
+        """Connected clients in a group."""
+        members = self._group_members.get(group)
+        if members is None:
+            members = [client for element_id, client in self.clients.items() if group.contains(element_id)]
+            self._group_members[group] = members
+        return members
 
     async def new_connection_shell(self, reader: TelnetReader, writer: TelnetWriter) -> None:
         """Telnet-style shell handler for new clients."""
@@ -37,20 +66,22 @@ class Clients(Receiver):
                 writer.close()
                 return
 
-            alliance, element = self._decode_field_element_id(inp)
+            element_id = self._decode_field_element_id(inp)
 
-            if alliance is None or element is None:
+            if element_id is None:
                 logger.error("Unable to connect client with ID %s", inp)
                 writer.write("NO\r\n")
                 await writer.drain()
                 return
 
-            logger.info("Connected client %s %s", alliance.name, element.name)
-            client = new_client(alliance, element, self)
+            protocol_version = decode_protocol_version(inp)
+            logger.info("Connected client %s (protocol v%d)", element_id.name, protocol_version)
+            client = new_client(element_id, self, protocol_version)
+            client.tracer = self.tracer
             try:
                 self.new_clients.append(client)
-                self.clients[alliance][element] =client
-                writer.write("OK\r\n")
+                self.connect(client)
+                writer.write(f"{handshake_response(protocol_version)}\r\n")
                 await writer.drain()
                 await client.shell(reader, writer)
             except Exception as e:
@@ -58,18 +89,21 @@ class Clients(Receiver):
                 logger.exception(e)
                 if isinstance(e, ClientException):
                     # Need to do away with the client object because it died
-                    stored_client = self.clients[e.client.alliance][e.client.field_element]
-                    if stored_client is e.client:
-                        self.clients[e.client.alliance][e.client.field_element] = None
+                    self.disconnect(e.client)
         except Exception as e:
             logger.error("Client connection shell caught exception initing client")
             logger.exception(e)
 
 
-    def _decode_field_element_id(self, data: str) -> tuple[Alliance|None, FieldElement|None]:
-        """Decodes the alliance and field element, or returns None,None if cannot decode."""
+    def _decode_field_element_id(self, data: str) -> ElementId | None:
+        """Decodes the field element ID from a hello, or returns None if cannot decode.
+
+        The hello is H, alliance (R or B), element (A, S or D for a display),
+        then optionally the protocol version and the element's index (e.g. 'HRA',
+        'HRA2', 'HRA21').
+        """
         if len(data) < 3 or data[0] != 'H':
-            return None,None
+            return None
 
         alliance: Alliance
         if data[1] == 'R':
@@ -77,17 +111,31 @@ class Clients(Receiver):
         elif data[1] == 'B':
             alliance = Alliance.BLUE
         else:
-            return None,None
+            return None
 
         field_element: FieldElement
         if data[2] == 'A':
             field_element = FieldElement.AMP
         elif data[2] == 'S':
             field_element = FieldElement.SPEAKER
+        elif data[2] == 'D':
+            field_element = FieldElement.DISPLAY
         else:
-            return None,None
+            return None
 
-        return alliance, field_element
+        index = int(data[4]) if data[4:5].isdigit() else 0
+
+        return ElementId(alliance, field_element, index)
+
+    def all_in_sync(self) -> bool:
+        """True if every required field element is connected and all elements have confirmed everything sent to them.
+
+        Commands carried by the multicast field state are never acknowledged;
+        for those, this only means the current field state has been sent.
+        """
+        return (all(element_id in self.clients for element_id in REQUIRED_ELEMENTS)
+                and all(client.in_sync() for client in self.clients.values())
+                and (self.broadcaster is None or self.broadcaster.sent()))
 
     def get_messages(self) -> list[ClientMessage]:
         """Receives all queued messages."""
@@ -103,21 +151,52 @@ class Clients(Receiver):
 
     def receive_message(self, alliance: Alliance, element: FieldElement, message:Message):
         """Receive and enqueue a message."""
-        self._messages.append(ClientMessage(alliance, element, message))
+        trace = current_trace.get()
+        if trace is not None:
+            trace.mark_queued()
+        self._messages.append(ClientMessage(alliance, element, message, trace))
 
     async def output(self, alliance: Alliance, element: FieldElement, message: str) -> None:
-        """Outputs a message to the specified client.
+        """Outputs a message to the specified field element(s).
 
         Args:
           alliance: Which alliance to send message to.
-          element: Which field element on that alliance to send message to.
+          element: Which type of field element on that alliance to send message to.
+            Every element of that type on the alliance receives the message.
           message: Message to send, *without* \\r\\n suffix.
         """
+        if not await self.output_group(group_for(alliance, element), message):
+            logger.error("Unable to send: no client connected",
+                         extra=fields(message=message, alliance=alliance.name, element=element.name))
 
-        print(f'Sending {message}')
-        client = self.clients[alliance][element]
-        if client is None:
-            logger.error("Unable to send %s to %s, %s: no client connected.", message, alliance, element)
-            return
+    async def output_group(self, group: ElementGroup, message: str) -> bool:
+        """Outputs a message to every element in a group.
 
-        await client.output(message)
+        Args:
+          group: Elements to send message to.
+          message: Message to send, *without* \\r\\n suffix.
+
+        Return:
+          True if the message reached at least one element.
+        """
+        logger.debug("Sending", extra=fields(message=message, group=group.name))
+
+        # Elements covered by the multicast field state don't also need it over TCP.
+        broadcast: set[tuple[Alliance, FieldElement]] = set()
+        if self.broadcaster is not None:
+            for alliance in group.alliances:
+                for element in group.elements:
+                    if self.broadcaster.update(alliance, element, message):
+                        broadcast.add((alliance, element))
+
+        for client in self.members(group):
+            if client.element_id.index == 0 and (client.alliance, client.field_element) in broadcast:
+                continue
+            await client.output(message)
+
+        return bool(broadcast) or bool(self.members(group))
+
+    def flush_broadcast(self, cur_time_ns: int) -> None:
+        """Multicast field state to all elements, if broadcasting is enabled."""
+        if self.broadcaster is not None:
+            self.broadcaster.flush(cur_time_ns)
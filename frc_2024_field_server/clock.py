@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Final
+
+"""Mapping field element clocks onto the server's clock.
+
+Elements stamp sensor events with their millis() clock, and stamp each v2 ack
+with it too. An ack pairs the element's clock with the server's send and
+receive times of the acknowledged frame, which bounds the element's clock
+reading to that round trip, NTP style: taking the midpoint of the round trip
+as the moment of the reading is off by at most half the round trip.
+
+Each estimate is the recent sample with the smallest error bound, where the
+bound of an older sample also grows by how far the element's clock may have
+drifted since.
+"""
+
+# Samples kept per element.
+CLOCK_SAMPLES: Final = 8
+
+# Worst-case drift of an element clock against the server's; Arduino boards on
+# ceramic resonators can be off by ~0.1%.
+MAX_DRIFT: Final = 0.001
+
+ELEMENT_CLOCK_MODULUS: Final = 1 << 32
+
+
+@dataclass(frozen=True)
+class ClockSample:
+    server_ns: int  # midpoint of the round trip
+    element_ms: int
+    round_trip_ns: int
+
+    def error_bound_ns(self, now_ns: int) -> float:
+        """How far off mapping through this sample can be at `now_ns`."""
+        return self.round_trip_ns / 2 + (now_ns - self.server_ns) * MAX_DRIFT
+
+
+class ElementClock:
+    """Running estimate of one element's clock, in time.monotonic_ns() terms."""
+
+    def __init__(self):
+        self._samples: deque[ClockSample] = deque(maxlen=CLOCK_SAMPLES)
+
+    def add_sample(self, sent_ns: int, received_ns: int, element_ms: int) -> None:
+        """Record an element clock reading taken between `sent_ns` and `received_ns`."""
+        round_trip_ns = received_ns - sent_ns
+        self._samples.append(ClockSample(sent_ns + round_trip_ns // 2, element_ms, round_trip_ns))
+
+    def best_sample(self, now_ns: int) -> ClockSample | None:
+        """The sample with the smallest error bound at `now_ns`, if any."""
+        return min(self._samples, key=lambda sample: sample.error_bound_ns(now_ns), default=None)
+
+    def to_server_ns(self, element_ms: int, now_ns: int) -> int | None:
+        """Convert an element clock reading to server time, or None if there's no estimate yet."""
+        sample = self.best_sample(now_ns)
+        if sample is None:
+            return None
+        # millis() wraps every ~50 days; take the difference modulo that.
+        delta_ms = (element_ms - sample.element_ms + ELEMENT_CLOCK_MODULUS // 2) % ELEMENT_CLOCK_MODULUS \
+            - ELEMENT_CLOCK_MODULUS // 2
+        return sample.server_ns + delta_ms * 1_000_000
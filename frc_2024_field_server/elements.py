@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cache
+from frc_2024_field_server.message_receiver import Alliance, FieldElement
+from typing import Final
+
+"""Field element identities and named groups of elements."""
+
+
+@dataclass(frozen=True)
+class ElementId:
+    """Identity of one field element.
+
+    `index` distinguishes several elements of the same type on one alliance
+    (e.g. extra displays); the standard field has only index 0.
+    """
+    alliance: Alliance
+    element: FieldElement
+    index: int = 0
+
+    @property
+    def name(self) -> str:
+        suffix = f" {self.index}" if self.index else ""
+        return f"{self.alliance.name} {self.element.name}{suffix}"
+
+
+@dataclass(frozen=True)
+class ElementGroup:
+    """A named set of field elements, matched by alliance and element type."""
+    name: str
+    alliances: frozenset[Alliance] = frozenset(Alliance)
+    elements: frozenset[FieldElement] = frozenset(FieldElement)
+
+    def contains(self, element_id: ElementId) -> bool:
+        return element_id.alliance in self.alliances and element_id.element in self.elements
+
+
+ALL_ELEMENTS: Final = ElementGroup("all")
+ALL_RED: Final = ElementGroup("all red", alliances=frozenset({Alliance.RED}))
+ALL_BLUE: Final = ElementGroup("all blue", alliances=frozenset({Alliance.BLUE}))
+# Displays show their alliance's amp and speaker state, so they are sent
+# everything the amps and speakers are.
+ALL_AMPS: Final = ElementGroup("all amps", elements=frozenset({FieldElement.AMP, FieldElement.DISPLAY}))
+ALL_SPEAKERS: Final = ElementGroup("all speakers", elements=frozenset({FieldElement.SPEAKER, FieldElement.DISPLAY}))
+ALL_DISPLAYS: Final = ElementGroup("all displays", elements=frozenset({FieldElement.DISPLAY}))
+
+# Element types with inputs; a standard field has one of each per alliance.
+SCORING_ELEMENTS: Final = (FieldElement.SPEAKER, FieldElement.AMP)
+
+# The elements a standard field must have connected.
+REQUIRED_ELEMENTS: Final = tuple(ElementId(alliance, element) for alliance in Alliance for element in SCORING_ELEMENTS)
+
+
+@cache
+def group_for(alliance: Alliance, element: FieldElement) -> ElementGroup:
+    """Group of every element of one type on one alliance, plus the displays mirroring that type."""
+    elements = {element}
+    if element in SCORING_ELEMENTS:
+        elements.add(FieldElement.DISPLAY)
+    return ElementGroup(f"{alliance.name} {element.name}", frozenset({alliance}), frozenset(elements))
@@ -3,23 +3,24 @@
 Actions may modify state and update field elements in relation to new state.
 """
 
-from frc_2024_field_server.game.constants import AMP_NOTE_SCORE_FOR_MODE, AMPLIFIED_SPEAKER_NOTE_SCORE, UNAMPLIFIED_SPEAKER_NOTE_SCORE_FOR_MODE, AMP_TIME_NS
+import math
+from frc_2024_field_server.game.events import EventKind
 from frc_2024_field_server.game.modes import Mode
 from frc_2024_field_server.game.state import GameState
 from frc_2024_field_server.clients import Clients
+from frc_2024_field_server.elements import ALL_AMPS, ALL_SPEAKERS
 from frc_2024_field_server.message_receiver import Alliance, FieldElement
 
-async def score_amp_note(state: GameState, clients: Clients, alliance: Alliance):
-    """Score a note to the amp and update amp field displays."""
-    points = AMP_NOTE_SCORE_FOR_MODE[state.current_mode]
-
-    alliance_state = state.alliances[alliance]
-
-    alliance_state.score += points
-
-    if alliance_state.banked_notes < 2:
-        alliance_state.banked_notes += 1
+async def score_amp_note(state: GameState, clients: Clients, alliance: Alliance, when_ns: int | None = None):
+    """Score a note to the amp and update amp field displays.
 
+    If `when_ns` is specified, score it as of that time instead of cur_time_ns.
+    A note that arrives after the match ended still scores, but the displays
+    already show the next match's staging and are left alone.
+    """
+    state.record_event(alliance, EventKind.AMP_NOTE, when_ns)
+    if state.current_mode is Mode.SETUP:
+        return
     await update_amp_status_light(state, clients, alliance)
 
 async def update_amp_status_light(state: GameState, clients: Clients, alliance: Alliance):
@@ -29,24 +30,23 @@ async def update_amp_status_light(state: GameState, clients: Clients, alliance:
     low_light_message = "L1" if alliance_state.banked_notes >=1 else "L0"
     await clients.output(alliance, FieldElement.AMP, low_light_message)
 
-    if alliance_state.amp_end_ns != 0:
+    if alliance_state.amp_active(state.cur_time_ns):
         await clients.output(alliance, FieldElement.AMP, "HB")
     else:
         high_light_message = "H1" if alliance_state.banked_notes >= 2 else "H0"
         await clients.output(alliance, FieldElement.AMP, high_light_message)
 
-async def score_speaker_note(state: GameState, clients: Clients, alliance: Alliance):
-    """Score a note in the speaker."""
-    alliance_state = state.alliances[alliance]
-    if alliance_state.amp_end_ns != 0:
-        alliance_state.score += AMPLIFIED_SPEAKER_NOTE_SCORE
-    else:
-        alliance_state.score += UNAMPLIFIED_SPEAKER_NOTE_SCORE_FOR_MODE[state.current_mode]
+async def score_speaker_note(state: GameState, clients: Clients, alliance: Alliance, when_ns: int | None = None):
+    """Score a note in the speaker.
+
+    If `when_ns` is specified, score it as of that time instead of cur_time_ns.
+    """
+    state.record_event(alliance, EventKind.SPEAKER_NOTE, when_ns)
 
 async def activate_amp(state: GameState, clients: Clients, alliance: Alliance):
-    alliance_state = state.alliances[alliance]
-    alliance_state.banked_notes -= 2
-    alliance_state.amp_end_ns = state.cur_time_ns + AMP_TIME_NS
+    """Handle an amp button press, activating the amp if two notes are banked."""
+    if not state.record_event(alliance, EventKind.AMP_BUTTON):
+        return
     await update_amp_status_light(state, clients, alliance)
     await clients.output(alliance, FieldElement.SPEAKER, "AA")
 
@@ -56,31 +56,51 @@ async def set_speaker_amp_display(state: GameState, clients: Clients, alliance:
     await clients.output(alliance, FieldElement.SPEAKER, output_str)
 
 async def end_amp_time(state: GameState, clients: Clients, alliance: Alliance):
-    """Handle the end of an amp period."""
-    alliance_state = state.alliances[alliance]
-    alliance_state.amp_end_ns = 0
+    """Show the end of an amp period on the field displays.
+
+    Leaves amp_end_ns alone, so a note that tripped before the end but arrives
+    after it still scores amplified, as it would when its log is replayed.
+    """
+    state.amp_end_shown_ns[alliance] = state.alliances[alliance].amp_end_ns
     await update_amp_status_light(state, clients, alliance)
     await clients.output(alliance, FieldElement.SPEAKER, "A0")
 
 async def offer_coopertition(state: GameState, clients: Clients, alliance: Alliance):
-    """Record an alliance offering coopertition."""
-    alliance_state = state.alliances[alliance]
-    alliance_state.banked_notes -= 1
-    alliance_state.coopertition_offered = True
+    """Handle a coopertition button press, recording the offer if the rules allow it."""
+    if not state.record_event(alliance, EventKind.COOPERTITION_BUTTON):
+        return
     await update_amp_status_light(state, clients, alliance)
     await update_coopertition_lights(state, clients)
 
 async def update_coopertition_lights(state: GameState, clients: Clients):
     """Update the state of the coopertition lights."""
     if state.alliances[Alliance.BLUE].coopertition_offered and state.alliances[Alliance.RED].coopertition_offered:
-        await clients.output(Alliance.BLUE, FieldElement.AMP, "C1")
-        await clients.output(Alliance.RED, FieldElement.AMP, "C1")
+        await clients.output_group(ALL_AMPS, "C1")
         return
 
     if not state.current_mode is Mode.AUTONOMOUS and not state.coopertition_available():
-        await clients.output(Alliance.BLUE, FieldElement.AMP, "C0")
-        await clients.output(Alliance.RED, FieldElement.AMP, "C0")
+        await clients.output_group(ALL_AMPS, "C0")
         return
 
     await clients.output(Alliance.BLUE, FieldElement.AMP, "C1" if state.alliances[Alliance.BLUE].coopertition_offered else "CB")
     await clients.output(Alliance.RED, FieldElement.AMP, "C1" if state.alliances[Alliance.RED].coopertition_offered else "CB")
+
+async def refresh_alliance_displays(state: GameState, clients: Clients, alliance: Alliance):
+    """Resend an alliance's amp and speaker displays after its state was rebuilt."""
+    alliance_state = state.alliances[alliance]
+    if alliance_state.amp_end_ns != 0 and not alliance_state.amp_active(state.cur_time_ns):
+        await end_amp_time(state, clients, alliance)
+        return
+
+    await update_amp_status_light(state, clients, alliance)
+    remaining_secs = math.ceil(alliance_state.get_remaining_amp_time_ns(state.cur_time_ns) / 1e9)
+    await set_speaker_amp_display(state, clients, alliance, remaining_secs)
+
+async def stage_next_match(state: GameState, clients: Clients):
+    """Put every field element into its start-of-match display while in SETUP."""
+    await clients.output_group(ALL_AMPS, "L0")
+    await clients.output_group(ALL_AMPS, "H0")
+    # Coopertition is offerable from the start of autonomous.
+    await clients.output_group(ALL_AMPS, "CB")
+    await clients.output_group(ALL_SPEAKERS, "A0")
+    state.next_match_staged = True
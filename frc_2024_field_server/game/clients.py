@@ -1,5 +1,6 @@
 import math
 from frc_2024_field_server.client import Client
+from frc_2024_field_server.elements import ElementId
 from frc_2024_field_server.message_receiver import Alliance, FieldElement, Receiver
 from frc_2024_field_server.game.messages import Score, AmpButtonPressed, CoopertitionButtonPressed
 from frc_2024_field_server.game.modes import Mode
@@ -13,9 +14,9 @@ class AmpClient(Client):
     def handle_input(self, inp: str) -> None:
         if inp[0] == "R":
             if inp[1] == "A":
-                self.send_message(Score(FieldElement.AMP))
+                self.send_message(Score(FieldElement.AMP, self.sensor_time_ns(inp)))
             elif inp[1] == "S":
-                self.send_message(Score(FieldElement.SPEAKER))
+                self.send_message(Score(FieldElement.SPEAKER, self.sensor_time_ns(inp)))
             else:
                 self.report_unknown_input(inp)
                 return
@@ -27,36 +28,16 @@ class AmpClient(Client):
             self.report_unknown_input(inp)
 
     async def send_init_state(self, state: GameState) -> None:
-        alliance_state = state.alliances[self.alliance]
-
-        # amp light init
-        amp_light_high = "0"
-
-        if alliance_state.amp_end_ns:
-            amp_light_high = "B"
-        elif alliance_state.banked_notes > 1:
-            amp_light_high = "1"
-
-        amp_light_low = "1" if alliance_state.banked_notes > 0 else "0"
-
-        # coopertition status init
-        coopertition_light = "0"
-        if state.coopertition_accepted() or alliance_state.coopertition_offered:
-            coopertition_light = "1"
-        elif state.coopertition_available() or state.current_mode in [Mode.AUTONOMOUS, Mode.WAIT_FOR_TELEOP]:
-            coopertition_light = "B"
-
-        await self.output(f'L{amp_light_low}')
-        await self.output(f'H{amp_light_high}')
-        await self.output(f'C{coopertition_light}')
+        for msg in amp_init_state(state, self.alliance):
+            await self.output(msg)
 
 class SpeakerClient(Client):
-    def handle_input(self, inp: bytes) -> None:
+    def handle_input(self, inp: str) -> None:
         if inp[0] == "R":
             if inp[1] == "A":
-                self.send_message(Score(FieldElement.AMP))
+                self.send_message(Score(FieldElement.AMP, self.sensor_time_ns(inp)))
             elif inp[1] == "S":
-                self.send_message(Score(FieldElement.SPEAKER))
+                self.send_message(Score(FieldElement.SPEAKER, self.sensor_time_ns(inp)))
             else:
                 self.report_unknown_input(inp)
                 return
@@ -64,19 +45,57 @@ class SpeakerClient(Client):
             self.report_unknown_input(inp)
 
     async def send_init_state(self, state: GameState) -> None:
-        remaining_amp_time_ns = state.alliances[self.alliance].get_remaining_amp_time_ns(state.cur_time_ns)
-        remaining_amp_time_secs = math.ceil(remaining_amp_time_ns / 1e9)
+        for msg in speaker_init_state(state, self.alliance):
+            await self.output(msg)
+
+class DisplayClient(Client):
+    """A display with no inputs, showing its alliance's amp and speaker state."""
+    def handle_input(self, inp: str) -> None:
+        self.report_unknown_input(inp)
+
+    async def send_init_state(self, state: GameState) -> None:
+        for msg in amp_init_state(state, self.alliance) + speaker_init_state(state, self.alliance):
+            await self.output(msg)
+
+
+def amp_init_state(state: GameState, alliance: Alliance) -> list[str]:
+    """Commands that bring an amp's lights up to date."""
+    alliance_state = state.alliances[alliance]
+
+    # amp light init
+    amp_light_high = "0"
+
+    if alliance_state.amp_active(state.cur_time_ns):
+        amp_light_high = "B"
+    elif alliance_state.banked_notes > 1:
+        amp_light_high = "1"
+
+    amp_light_low = "1" if alliance_state.banked_notes > 0 else "0"
+
+    # coopertition status init
+    coopertition_light = "0"
+    if state.coopertition_accepted() or alliance_state.coopertition_offered:
+        coopertition_light = "1"
+    elif state.coopertition_available() or state.current_mode in [Mode.AUTONOMOUS, Mode.WAIT_FOR_TELEOP]:
+        coopertition_light = "B"
 
-        msg = "A" if remaining_amp_time_secs >= 10 else str(remaining_amp_time_secs)
-        await self.output(f'A{msg}')
+    return [f'L{amp_light_low}', f'H{amp_light_high}', f'C{coopertition_light}']
 
+def speaker_init_state(state: GameState, alliance: Alliance) -> list[str]:
+    """Commands that bring a speaker's amp countdown up to date."""
+    remaining_amp_time_ns = state.alliances[alliance].get_remaining_amp_time_ns(state.cur_time_ns)
+    remaining_amp_time_secs = math.ceil(remaining_amp_time_ns / 1e9)
 
+    msg = "A" if remaining_amp_time_secs >= 10 else str(remaining_amp_time_secs)
+    return [f'A{msg}']
 
 
-def new_client(alliance: Alliance, element: FieldElement, receiver: Receiver) -> Client:
-    if element == FieldElement.AMP:
-        return AmpClient(alliance, element ,receiver)
-    elif element == FieldElement.SPEAKER:
-        return SpeakerClient(alliance, element, receiver)
+def new_client(element_id: ElementId, receiver: Receiver, protocol_version: int) -> Client:
+    if element_id.element == FieldElement.AMP:
+        return AmpClient(element_id, receiver, protocol_version)
+    elif element_id.element == FieldElement.SPEAKER:
+        return SpeakerClient(element_id, receiver, protocol_version)
+    elif element_id.element == FieldElement.DISPLAY:
+        return DisplayClient(element_id, receiver, protocol_version)
     else:
-        raise UnknownClientException(f"No client for {element.name}")
+        raise UnknownClientException(f"No client for {element_id.name}")
@@ -27,3 +27,6 @@ AUTON_PERIOD_NS: Final[int] = 15_000_000_000
 TELEOP_PERIOD_NS: Final[int] = 135_000_000_000
 
 COOPERTITION_WINDOW_NS: Final[int] = 45_000_000_000
+
+# A second 'Go' press within this window starts a match even if the field isn't ready.
+MATCH_START_OVERRIDE_NS: Final[int] = 2_000_000_000
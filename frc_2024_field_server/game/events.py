@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+from enum import IntEnum
+from frc_2024_field_server.game.modes import Mode
+
+"""Match events: the inputs that alliance state is rebuilt from."""
+
+
+class EventKind(IntEnum):
+    AMP_NOTE = 0
+    SPEAKER_NOTE = 1
+    AMP_BUTTON = 2
+    COOPERTITION_BUTTON = 3
+
+
+@dataclass(frozen=True)
+class MatchEvent:
+    """One input from an alliance's field elements during a match.
+
+    Carries everything the game rules need to apply it, so it applies the same
+    way when replayed later.
+    """
+    kind: EventKind
+    time_ns: int
+    mode: Mode
+    coopertition_available: bool = False
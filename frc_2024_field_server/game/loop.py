@@ -5,11 +5,14 @@ import logging
 import math
 import time
 from frc_2024_field_server.game import actions
+from frc_2024_field_server.logs import fields
 from frc_2024_field_server.game.messages import Score, AmpButtonPressed, CoopertitionButtonPressed
 from frc_2024_field_server.game.state import GameState
 from frc_2024_field_server.game.modes import Mode
 from frc_2024_field_server.clients import Clients, ClientMessage
 from frc_2024_field_server.message_receiver import Alliance, FieldElement
+from frc_2024_field_server.shared_state import SharedStatePublisher
+from frc_2024_field_server.tracing import current_trace
 
 """The main game loop."""
 
@@ -19,39 +22,70 @@ MAIN_PERIOD_MSEC: Final = 50
 
 async def process_messages(state: GameState, clients: Clients, msgs: list[ClientMessage]) -> None:
     """Process incoming messages."""
-    for msg in msgs:
-        logger.debug("Received message [alliance: %s, element: %s, message: %s]",
-                    msg.alliance.name, msg.field_element.name, msg.message)
+    if logger.isEnabledFor(logging.DEBUG):
+        for msg in msgs:
+            logger.debug("Received message", extra=fields(alliance=msg.alliance.name,
+                                                          element=msg.field_element.name, message=msg.message))
+
+    # Inputs that arrived in the same tick apply in the order they happened.
+    for msg in sorted(msgs, key=lambda msg: input_time_ns(state, msg)):
+        if msg.trace is None:
+            await process_message(state, clients, msg)
+            continue
+
+        msg.trace.mark_dequeued()
+        token = current_trace.set(msg.trace)
+        try:
+            await process_message(state, clients, msg)
+        finally:
+            current_trace.reset(token)
+        msg.trace.mark_logic_done()
+
+def input_time_ns(state: GameState, msg: ClientMessage) -> int:
+    """When a message's input happened: when its sensor tripped, if known, otherwise now."""
+    if isinstance(msg.message, Score) and msg.message.time_ns:
+        return msg.message.time_ns
+    return state.cur_time_ns
+
+async def process_message(state: GameState, clients: Clients, msg: ClientMessage) -> None:
+    """Process a single incoming message."""
+    if isinstance(msg.message, Score):
+        # Scored by when the note tripped the sensor, which may be before the mode it arrived in.
+        when_ns = input_time_ns(state, msg)
+        if not state.game_active_at(when_ns):
+            return
+        if msg.message.element is FieldElement.AMP:
+            await actions.score_amp_note(state, clients, msg.alliance, when_ns)
+        else:
+            await actions.score_speaker_note(state, clients, msg.alliance, when_ns)
+        return
+
     if not state.game_active():
         return
 
-    for msg in msgs:
-        if isinstance(msg.message, Score):
-            if msg.message.element is FieldElement.AMP:
-                await actions.score_amp_note(state, clients, msg.alliance)
-            else:
-                await actions.score_speaker_note(state, clients, msg.alliance)
-        elif isinstance(msg.message, AmpButtonPressed):
-            alliance = state.alliances[msg.alliance]
-            if alliance.amp_end_ns == 0 and alliance.banked_notes == 2:
-                await actions.activate_amp(state, clients, msg.alliance)
-        elif isinstance(msg.message, CoopertitionButtonPressed):
-            alliance = state.alliances[msg.alliance]
-            if alliance.coopertition_offered:
-                return
-            if alliance.banked_notes > 0 and state.coopertition_available():
-                await actions.offer_coopertition(state, clients, msg.alliance)
+    if isinstance(msg.message, AmpButtonPressed):
+        await actions.activate_amp(state, clients, msg.alliance)
+    elif isinstance(msg.message, CoopertitionButtonPressed):
+        await actions.offer_coopertition(state, clients, msg.alliance)
 
+async def apply_corrections(state: GameState, clients: Clients) -> None:
+    """Apply referee corrections and late inputs and, mid-match, bring the field displays in line with them."""
+    corrected = state.apply_corrections()
+    if not corrected or state.current_mode is Mode.SETUP:
+        return
 
+    for alliance in corrected:
+        await actions.refresh_alliance_displays(state, clients, alliance)
+    await actions.update_coopertition_lights(state, clients)
 
 
 async def update_amp_timer(state: GameState, clients: Clients, alliance: Alliance) -> None:
     """Update amp timer, if running."""
     alliance_state = state.alliances[alliance]
-    if alliance_state.amp_end_ns == 0:
+    if alliance_state.amp_end_ns == 0 or state.amp_end_shown_ns[alliance] == alliance_state.amp_end_ns:
         return
 
-    if state.cur_time_ns > alliance_state.amp_end_ns:
+    if not alliance_state.amp_active(state.cur_time_ns):
         await actions.end_amp_time(state, clients, alliance)
         return
 
@@ -69,8 +103,11 @@ async def check_coopertition_update(state: GameState, clients: Clients) -> None:
     if not state.coopertition_available(state.cur_time_ns) and state.coopertition_available(state.prev_time_ns):
         await actions.update_coopertition_lights(state, clients)
 
-async def game_loop(state: GameState, clients: Clients) -> None:
-    """The main loop of the game. Runs continuously until game is completed."""
+async def game_loop(state: GameState, clients: Clients, publisher: SharedStatePublisher | None = None) -> None:
+    """The main loop of the game. Runs continuously until game is completed.
+
+    If `publisher` is set, state is published through it at the end of every tick.
+    """
     while True:
         state.prev_time_ns = state.cur_time_ns
         state.cur_time_ns = time.monotonic_ns()
@@ -84,9 +121,16 @@ async def game_loop(state: GameState, clients: Clients) -> None:
         new_clients = clients.get_new_clients()
         for client in new_clients:
             await client.send_init_state(state)
+        if new_clients and state.current_mode is Mode.SETUP:
+            # Init state reflects the last match; stage the newcomer for the next one.
+            state.next_match_staged = False
+
+        if state.current_mode is Mode.SETUP and not state.next_match_staged:
+            await actions.stage_next_match(state, clients)
 
         msgs = clients.get_messages()
         await process_messages(state, clients, msgs)
+        await apply_corrections(state, clients)
 
         if state.game_active():
             await update_amp_timer(state, clients, Alliance.BLUE)
@@ -101,6 +145,9 @@ async def game_loop(state: GameState, clients: Clients) -> None:
             await actions.set_speaker_amp_display(state, clients, Alliance.BLUE, 0)
             await actions.set_speaker_amp_display(state, clients, Alliance.RED, 0)
 
+        clients.flush_broadcast(state.cur_time_ns)
+        if publisher is not None:
+            publisher.publish(state)
 
         await asyncio.sleep(MAIN_PERIOD_MSEC / 1000)
 
@@ -7,6 +7,8 @@ from frc_2024_field_server.message_receiver import FieldElement, Message
 class Score(Message):
     """Message indicating a point was scored."""
     element: FieldElement
+    # When the sensor tripped, in time.monotonic_ns() terms, or 0 to use when it arrived.
+    time_ns: int = 0
 
 @dataclass
 class AmpButtonPressed(Message):
@@ -1,16 +1,33 @@
+from __future__ import annotations
+
 import asyncio
+import bisect
 import logging
 import time
-from frc_2024_field_server.game.constants import AUTON_PERIOD_NS, TELEOP_PERIOD_NS, COOPERTITION_WINDOW_NS
+from frc_2024_field_server.game.constants import (AMP_NOTE_SCORE_FOR_MODE, AMPLIFIED_SPEAKER_NOTE_SCORE, AMP_TIME_NS,
+    AUTON_PERIOD_NS, TELEOP_PERIOD_NS, COOPERTITION_WINDOW_NS, MATCH_START_OVERRIDE_NS,
+    UNAMPLIFIED_SPEAKER_NOTE_SCORE_FOR_MODE)
+from frc_2024_field_server.game.events import EventKind, MatchEvent
 from frc_2024_field_server.game.modes import Mode
+from frc_2024_field_server.game.stats import ScoringStats
 from frc_2024_field_server.message_receiver import Alliance
 from typing import Final
 
 logger = logging.getLogger(__name__)
 
 
+
 """State of game."""
 
+# Events between alliance state checkpoints; a replay starts at most this many events before the change.
+CHECKPOINT_INTERVAL: Final = 16
+
+# Mode each timed mode moves to when its time runs out.
+TIMED_MODE_SUCCESSOR: Final = {
+    Mode.AUTONOMOUS: Mode.WAIT_FOR_TELEOP,
+    Mode.TELEOP: Mode.SETUP,
+}
+
 class GameState:
     """State of the entire game."""
 
@@ -22,47 +39,174 @@ class GameState:
         self.alliances = (AllianceState(), AllianceState())
         self.first_game_frame = False
 
+        # Mode changes this match, as (time, mode, mode_end_ns), so inputs can be
+        # scored in the mode they happened in rather than the one they arrived in.
+        self._mode_changes: list[tuple[int, Mode, int]] = []
+
+        # Alliance state is the result of replaying these logs; see record_event and void_event.
+        self.logs = (AllianceLog(self.alliances[0]), AllianceLog(self.alliances[1]))
+        self._pending_voids: list[tuple[Alliance, MatchEvent]] = []
+        self._corrected: set[Alliance] = set()
+
+        # Per alliance, the amp_end_ns of the amp period the field displays last
+        # showed ending. Alliance state keeps amp_end_ns after the amp runs out,
+        # so notes that tripped before then still score amplified.
+        self.amp_end_shown_ns = [0, 0]
+
+        # Match pipeline. The next match's reset state is built ahead of time and
+        # swapped in at match start; its displays are staged on the field during SETUP.
+        self.match_number = 0
+        self._next_alliances = (AllianceState(), AllianceState())
+        self.next_match_staged = False
+        self.last_match_end_ns = 0
+        self.last_turnaround_ns = 0
+        self._start_requested_ns = 0
+
     def check_mode_progression(self) -> bool:
         """Check if mode should progress and move it forward if it should.
 
         Return:
           True if we are at match end."""
-        next_mode: Mode | None = None
-
-        if self.current_mode is Mode.AUTONOMOUS:
-            next_mode = Mode.WAIT_FOR_TELEOP
-        elif self.current_mode is Mode.TELEOP:
-            next_mode = Mode.SETUP
+        next_mode = TIMED_MODE_SUCCESSOR.get(self.current_mode)
 
         if self.cur_time_ns > self.mode_end_ns and next_mode is not None:
-            self.current_mode = next_mode
-            self.mode_end_ns = 0
+            self._change_mode(next_mode, 0, self.mode_end_ns)
+            if next_mode is Mode.SETUP:
+                self.last_match_end_ns = self.cur_time_ns
 
         return next_mode is Mode.SETUP
 
-    def _start_round(self) -> None:
-        """Initialize the round by zeroing out the scores and clearing state."""
-        self.alliances[Alliance.RED].start_round()
-        self.alliances[Alliance.BLUE].start_round()
-        self.first_game_frame = True
+    def _change_mode(self, mode: Mode, mode_end_ns: int, when_ns: int) -> None:
+        """Change mode, recording when the change took effect."""
+        self.current_mode = mode
+        self.mode_end_ns = mode_end_ns
+        self._mode_changes.append((when_ns, mode, mode_end_ns))
+
+    def mode_at(self, when_ns: int) -> tuple[Mode, int]:
+        """Mode and mode end time at `when_ns`, this match.
 
-    def handle_go_button(self) -> None:
-        """Handle push of the explicit 'Go' button (space bar)."""
+        Accounts for a timed mode that has run out but that the game loop
+        hasn't moved on from yet.
+        """
+        for start_ns, mode, mode_end_ns in reversed(self._mode_changes):
+            if start_ns <= when_ns:
+                if mode_end_ns and when_ns > mode_end_ns:
+                    return TIMED_MODE_SUCCESSOR[mode], 0
+                return mode, mode_end_ns
+        return Mode.SETUP, 0
+
+    def _start_round(self, current_ns: int) -> None:
+        """Start the next match by swapping in its pre-built reset state."""
+        self.alliances = self._next_alliances
+        self._next_alliances = (AllianceState(), AllianceState())
+        self.logs = (AllianceLog(self.alliances[0]), AllianceLog(self.alliances[1]))
+        self._pending_voids.clear()
+        self._corrected.clear()
+        self._mode_changes.clear()
+        self.amp_end_shown_ns = [0, 0]
+        self.match_number += 1
+
+        # If the field wasn't staged for this match, reset the displays on the first frame instead.
+        self.first_game_frame = not self.next_match_staged
+        self.next_match_staged = False
+        self._start_requested_ns = 0
+
+        if self.last_match_end_ns:
+            self.last_turnaround_ns = current_ns - self.last_match_end_ns
+            logger.info("Match %d started %.1fs after the previous match ended",
+                        self.match_number, self.last_turnaround_ns / 1e9)
+
+    def record_event(self, alliance: Alliance, kind: EventKind, when_ns: int | None = None) -> bool:
+        """Record an input from an alliance's elements and apply it to that alliance's state.
+
+        Args:
+          when_ns: When the input happened, if known; otherwise now. An input
+            that happened before the alliance's latest event is put in its place
+            in the log and the alliance's state is rebuilt, as for a void.
+
+        Return:
+          True if the game rules gave the input any effect (e.g. False for an
+          amp button press without two banked notes).
+        """
+        if when_ns is None:
+            when_ns = self.cur_time_ns
+        mode, mode_end_ns = self.mode_at(when_ns)
+        event = MatchEvent(kind, when_ns, mode, self.coopertition_available(when_ns, mode, mode_end_ns))
+
+        log = self.logs[alliance]
+        if log.in_order(event):
+            return log.append(self.alliances[alliance], event)
+
+        index = log.insert(event)
+        self._replace_alliance(alliance, log.replay(index))
+        self._corrected.add(alliance)
+        return log.applied[index]
+
+    def void_event(self, alliance: Alliance, event: MatchEvent) -> None:
+        """Ask for one of an alliance's events to be voided.
+
+        The alliance's state is rebuilt without it at the start of the next
+        apply_corrections(), so the game loop can update the field to match.
+        """
+        self._pending_voids.append((alliance, event))
+
+    def apply_corrections(self) -> set[Alliance]:
+        """Apply pending voids, rebuilding the affected alliances' state.
+
+        Return:
+          The alliances whose state was rebuilt since the last call, by voids
+          or by late inputs.
+        """
+        for alliance, event in self._pending_voids:
+            rebuilt = self.logs[alliance].void(event)
+            if rebuilt is None:
+                continue
+            self._replace_alliance(alliance, rebuilt)
+            self._corrected.add(alliance)
+            logger.info("Voided %s %s; score is now %d", alliance.name, event.kind.name, rebuilt.score)
+        self._pending_voids.clear()
+
+        corrected = self._corrected
+        self._corrected = set()
+        return corrected
+
+    def _replace_alliance(self, alliance: Alliance, alliance_state: AllianceState) -> None:
+        alliances = list(self.alliances)
+        alliances[alliance] = alliance_state
+        self.alliances = (alliances[0], alliances[1])
+
+    def ready_to_start(self, elements_in_sync: bool) -> bool:
+        """Return True if the next match can start: displays staged and confirmed by the elements."""
+        return self.current_mode is Mode.SETUP and self.next_match_staged and elements_in_sync
+
+    def handle_go_button(self, elements_in_sync: bool = True) -> None:
+        """Handle push of the explicit 'Go' button (space bar).
+
+        Args:
+          elements_in_sync: Whether every field element has confirmed its display state.
+            If the field isn't ready, starting a match takes a second press within
+            MATCH_START_OVERRIDE_NS.
+        """
         current_ns = time.monotonic_ns()
         if self.current_mode is Mode.SETUP:
-            self.current_mode = Mode.AUTONOMOUS
-            self._start_round()
-            self.mode_end_ns = current_ns + AUTON_PERIOD_NS
+            if not self.ready_to_start(elements_in_sync):
+                if current_ns - self._start_requested_ns > MATCH_START_OVERRIDE_NS:
+                    self._start_requested_ns = current_ns
+                    logger.warning("Field not ready for match %d (staged: %s, in sync: %s); press again to start anyway",
+                                   self.match_number + 1, self.next_match_staged, elements_in_sync)
+                    return
+                logger.warning("Starting match %d without a ready field", self.match_number + 1)
+            self._start_round(current_ns)
+            self._change_mode(Mode.AUTONOMOUS, current_ns + AUTON_PERIOD_NS, current_ns)
             return
 
         if self.current_mode is Mode.WAIT_FOR_TELEOP:
-            self.current_mode = Mode.TELEOP
-            self.mode_end_ns = current_ns + TELEOP_PERIOD_NS
+            self._change_mode(Mode.TELEOP, current_ns + TELEOP_PERIOD_NS, current_ns)
             return
 
         # Override mid-match. Cancel match.
-        self.current_mode = Mode.SETUP
-        self.mode_end_ns = 0
+        self._change_mode(Mode.SETUP, 0, current_ns)
+        self.last_match_end_ns = current_ns
 
     def get_remaining_time_ns(self, when=None) -> int:
         """If in a timed mode, get remaining time in nanos. Otherwise, get 0.
@@ -82,15 +226,26 @@ class GameState:
         """Return True if the game is in an active state (autonomous or teleop)."""
         return self.current_mode in [Mode.AUTONOMOUS, Mode.TELEOP]
 
-    def coopertition_available(self, when=None) -> bool:
+    def game_active_at(self, when_ns: int) -> bool:
+        """Return True if the game was in an active state at `when_ns`."""
+        return self.mode_at(when_ns)[0] in [Mode.AUTONOMOUS, Mode.TELEOP]
+
+    def coopertition_available(self, when=None, mode: Mode | None = None, mode_end_ns: int = 0) -> bool:
         """Return True if pressing the coopertition button is allowed at this time.
 
         If `when` is specified, compute off of that timestamp instead of cur_time_ns.
+        If `mode` is specified, compute off of it and `mode_end_ns` (e.g. from
+        mode_at()) instead of the current mode.
         """
-        if not self.current_mode is Mode.TELEOP:
+        if mode is None:
+            mode = self.current_mode
+            mode_end_ns = self.mode_end_ns
+        if not mode is Mode.TELEOP:
             return False
 
-        time_remaining = self.get_remaining_time_ns(when)
+        if when is None:
+            when = self.cur_time_ns
+        time_remaining = 0 if mode_end_ns == 0 or when > mode_end_ns else mode_end_ns - when
         return time_remaining > TELEOP_PERIOD_NS - COOPERTITION_WINDOW_NS
 
     def coopertition_accepted(self) -> bool:
@@ -102,17 +257,166 @@ class AllianceState:
 
     def __init__(self):
         self.score = 0
-        self.amp_end_ns = 0  # if nonzero, time in match that the amp will wrap up.
+        self.amp_end_ns = 0  # if nonzero, time in match that the latest amp period wraps up.
         self.banked_notes = 0
         self.coopertition_offered = False
+        self.stats = ScoringStats()
 
-    def start_round(self) -> None:
-        """Init state for start of round."""
-        self.score = 0
-        self.amp_end_ns = 0
-        self.banked_notes = 0
-        self.coopertition_offered = False
+    def copy(self) -> AllianceState:
+        result = AllianceState.__new__(AllianceState)
+        result.score = self.score
+        result.amp_end_ns = self.amp_end_ns
+        result.banked_notes = self.banked_notes
+        result.coopertition_offered = self.coopertition_offered
+        result.stats = self.stats.copy()
+        return result
 
     def get_remaining_amp_time_ns(self, cur_time_ns: int) -> int:
         """Get remaining amp time, or 0 if amp is off."""
         return 0 if (self.amp_end_ns == 0 or self.amp_end_ns < cur_time_ns) else self.amp_end_ns - cur_time_ns
+
+    def amp_active(self, when_ns: int) -> bool:
+        """Return True if the amp is on at `when_ns`, whether or not the displays show it yet."""
+        return self.amp_end_ns != 0 and when_ns <= self.amp_end_ns
+
+    def apply(self, event: MatchEvent) -> bool:
+        """Apply one event by the game rules.
+
+        Depends only on this state and the event, so replaying a log gives the
+        same result as applying it live.
+
+        Return:
+          True if the event had any effect.
+        """
+        if event.kind is EventKind.AMP_NOTE:
+            points = AMP_NOTE_SCORE_FOR_MODE[event.mode]
+            self.score += points
+            self.stats.record_amp_note(points, event.mode, event.time_ns)
+            if self.banked_notes < 2:
+                self.banked_notes += 1
+            return True
+
+        if event.kind is EventKind.SPEAKER_NOTE:
+            amplified = self.amp_active(event.time_ns)
+            if amplified:
+                points = AMPLIFIED_SPEAKER_NOTE_SCORE
+            else:
+                points = UNAMPLIFIED_SPEAKER_NOTE_SCORE_FOR_MODE[event.mode]
+            self.score += points
+            self.stats.record_speaker_note(points, amplified, event.mode, event.time_ns)
+            return True
+
+        if event.kind is EventKind.AMP_BUTTON:
+            if self.amp_active(event.time_ns) or self.banked_notes < 2:
+                return False
+            self.banked_notes -= 2
+            self.amp_end_ns = event.time_ns + AMP_TIME_NS
+            return True
+
+        # Coopertition button
+        if self.coopertition_offered or self.banked_notes == 0 or not event.coopertition_available:
+            return False
+        self.banked_notes -= 1
+        self.coopertition_offered = True
+        return True
+
+class AllianceLog:
+    """Log of one alliance's match events in time order, with periodic checkpoints.
+
+    The alliance's state is always what applying every non-voided event in order
+    gives. Checkpoint i is the state after the first i * CHECKPOINT_INTERVAL
+    events, so voiding or inserting an event replays from the checkpoint before
+    it to the end of the log: every event after the change, plus fewer than
+    CHECKPOINT_INTERVAL before it. Voiding the first event of a match replays
+    the whole log.
+    """
+
+    def __init__(self, initial: AllianceState):
+        self.events: list[MatchEvent] = []
+        # Per event: whether it had an effect as of the last replay, and whether it was voided.
+        self.applied: list[bool] = []
+        self.voided: list[bool] = []
+        self._checkpoints = [initial.copy()]
+
+    def in_order(self, event: MatchEvent) -> bool:
+        """Return True if the event goes at the end of the log."""
+        return not self.events or event.time_ns >= self.events[-1].time_ns
+
+    def append(self, state: AllianceState, event: MatchEvent) -> bool:
+        """Append an event that is in order and apply it to the live state.
+
+        Return:
+          True if the event had any effect.
+        """
+        applied = state.apply(event)
+        self.events.append(event)
+        self.applied.append(applied)
+        self.voided.append(False)
+        if len(self.events) % CHECKPOINT_INTERVAL == 0:
+            self._checkpoints.append(state.copy())
+        return applied
+
+    def insert(self, event: MatchEvent) -> int:
+        """Insert an event in time order, after any events at the same time.
+
+        The caller must replay() from the returned index.
+        """
+        index = bisect.bisect_right(self.events, event.time_ns, key=lambda logged: logged.time_ns)
+        self.events.insert(index, event)
+        self.applied.insert(index, False)
+        self.voided.insert(index, False)
+        return index
+
+    def void(self, event: MatchEvent) -> AllianceState | None:
+        """Void an event.
+
+        Return:
+          The state rebuilt without the event, or None if the event isn't in
+          the log or was already voided.
+        """
+        for index in range(len(self.events) - 1, -1, -1):
+            if self.events[index] is event:
+                break
+        else:
+            return None
+        if self.voided[index]:
+            return None
+        self.voided[index] = True
+        return self.replay(index)
+
+    def replay(self, index: int) -> AllianceState:
+        """Rebuild the state after a change to the log at `index`."""
+        checkpoint = index // CHECKPOINT_INTERVAL
+        del self._checkpoints[checkpoint + 1:]
+        state = self._checkpoints[checkpoint].copy()
+        for i in range(checkpoint * CHECKPOINT_INTERVAL, len(self.events)):
+            self.applied[i] = not self.voided[i] and state.apply(self.events[i])
+            if (i + 1) % CHECKPOINT_INTERVAL == 0:
+                self._checkpoints.append(state.copy())
+        return state
+
+    def matches_replay(self, state: AllianceState) -> bool:
+        """Return True if `state` is what replaying the whole log from the start gives.
+
+        A consistency check: O(events), and skips the checkpoints.
+        """
+        replayed = self._checkpoints[0].copy()
+        for event, voided in zip(self.events, self.voided):
+            if not voided:
+                replayed.apply(event)
+        return _outcome(replayed) == _outcome(state)
+
+    def last_voidable(self) -> MatchEvent | None:
+        """The latest event that is in effect, if any."""
+        for i in range(len(self.events) - 1, -1, -1):
+            if self.applied[i] and not self.voided[i]:
+                return self.events[i]
+        return None
+
+
+def _outcome(state: AllianceState) -> tuple:
+    """Everything scoring decided about an alliance, leaving out the rolling window (trimmed as it's read)."""
+    stats = state.stats
+    return (state.score, state.amp_end_ns, state.banked_notes, state.coopertition_offered,
+            stats.amp_points, stats.speaker_points, stats.amp_notes, stats.amplified_notes,
+            stats.unamplified_notes, stats.points_by_mode)
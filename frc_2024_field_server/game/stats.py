@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from collections import deque
+from frc_2024_field_server.game.modes import Mode
+from typing import Final
+
+"""Live scoring breakdowns, maintained incrementally as notes are scored."""
+
+RATE_WINDOW_NS: Final[int] = 10_000_000_000
+
+
+class ScoringStats:
+    """Scoring breakdown for one alliance in one match.
+
+    Every update and read is O(1) (amortized, for the rolling window), so the UI
+    can read it every frame.
+    """
+
+    def __init__(self):
+        self.amp_points = 0
+        self.speaker_points = 0
+        self.amp_notes = 0
+        self.amplified_notes = 0
+        self.unamplified_notes = 0
+        self.points_by_mode = {mode: 0 for mode in Mode}
+
+        # (time scored, points) for scores inside the rolling window, oldest first
+        self._window: deque[tuple[int, int]] = deque()
+        self._window_points = 0
+
+    def copy(self) -> ScoringStats:
+        # Field by field rather than copy.copy(), which costs more than the copying;
+        # alliance state is copied at every log checkpoint.
+        result = ScoringStats.__new__(ScoringStats)
+        result.amp_points = self.amp_points
+        result.speaker_points = self.speaker_points
+        result.amp_notes = self.amp_notes
+        result.amplified_notes = self.amplified_notes
+        result.unamplified_notes = self.unamplified_notes
+        result.points_by_mode = self.points_by_mode.copy()
+        result._window = self._window.copy()
+        result._window_points = self._window_points
+        return result
+
+    def record_amp_note(self, points: int, mode: Mode, when_ns: int) -> None:
+        """Record a note scored in the amp."""
+        self.amp_points += points
+        self.amp_notes += 1
+        self._record(points, mode, when_ns)
+
+    def record_speaker_note(self, points: int, amplified: bool, mode: Mode, when_ns: int) -> None:
+        """Record a note scored in the speaker."""
+        self.speaker_points += points
+        if amplified:
+            self.amplified_notes += 1
+        else:
+            self.unamplified_notes += 1
+        self._record(points, mode, when_ns)
+
+    def _record(self, points: int, mode: Mode, when_ns: int) -> None:
+        self.points_by_mode[mode] += points
+        self._window.append((when_ns, points))
+        self._window_points += points
+        # Expire here too, so the window stays bounded even if nobody reads it.
+        self._expire(when_ns)
+
+    def _expire(self, now_ns: int) -> None:
+        cutoff = now_ns - RATE_WINDOW_NS
+        while self._window and self._window[0][0] <= cutoff:
+            _, points = self._window.popleft()
+            self._window_points -= points
+
+    def recent_points(self, now_ns: int) -> int:
+        """Points scored in the last RATE_WINDOW_NS."""
+        self._expire(now_ns)
+        return self._window_points
+
+    def recent_points_per_sec(self, now_ns: int) -> float:
+        """Scoring rate over the last RATE_WINDOW_NS."""
+        return self.recent_points(now_ns) / (RATE_WINDOW_NS / 1e9)
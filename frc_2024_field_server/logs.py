@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import io
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import sys
+import threading
+from typing import TextIO
+
+"""Logging setup that keeps log I/O off the event loop thread.
+
+All records go through a queue to a background writer thread, which is the only
+place that writes to the real stderr. Records are enqueued unformatted; the
+writer does the formatting. This means log arguments should be values that
+won't change after the call (strings, numbers, enums), not live state objects.
+
+Hot-path log calls attach structured fields with `extra=fields(...)` rather
+than formatting them into the message; the writer renders them after the
+message as key=value pairs.
+
+stdout and stderr are also replaced so that stray writes from the event loop
+thread (print, tracebacks written by libraries) go through the same queue, so
+no stdout or stderr I/O happens on the loop thread. Each line written there is
+re-emitted as an INFO record from the logger 'stdout' or 'stderr', and so ends
+up on the real stderr with the other log output. Writes from other threads go
+straight to the real streams.
+"""
+
+
+def fields(**values: object) -> dict[str, dict[str, object]]:
+    """Structured fields for a log call, e.g. `logger.debug("Sending", extra=fields(group=name))`."""
+    return {'fields': values}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record, followed by its structured fields as key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in values.items())
+        return text
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queue handler that defers all formatting to the writer thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default implementation formats the message here, on the calling
+        # thread, so that records can be pickled. Ours stay in-process.
+        return record
+
+
+class LoopThreadStream(io.TextIOBase):
+    """Stand-in for stdout or stderr that routes writes from one thread to a logger.
+
+    Writes from other threads go to the wrapped stream unchanged.
+    """
+
+    def __init__(self, stream: TextIO, logger: logging.Logger, thread_id: int):
+        self._stream = stream
+        self._logger = logger
+        self._thread_id = thread_id
+        self._pending = ''
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if threading.get_ident() != self._thread_id:
+            return self._stream.write(s)
+
+        self._pending += s
+        while '\n' in self._pending:
+            line, self._pending = self._pending.split('\n', 1)
+            self._logger.info('%s', line)
+        return len(s)
+
+    def flush(self) -> None:
+        if threading.get_ident() != self._thread_id:
+            self._stream.flush()
+
+
+def parse_levels(specs: list[str]) -> dict[str, int]:
+    """Parse log level specs of the form LEVEL or LOGGER=LEVEL.
+
+    Return:
+      Map from logger name to level. The root logger is keyed by ''.
+    """
+    levels: dict[str, int] = {}
+    for spec in specs:
+        name, _, level_name = spec.rpartition('=')
+        level = logging.getLevelName(level_name.upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level {level_name}")
+        levels[name] = level
+    return levels
+
+
+def start_logging(levels: dict[str, int]) -> QueueListener:
+    """Route all logging and loop-thread stdout/stderr through a background writer.
+
+    Must be called from the event loop thread.
+
+    Args:
+      levels: Map from logger name to level. '' sets the root logger level.
+
+    Return:
+      The running listener. Stop it at shutdown to flush remaining records.
+    """
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+
+    writer = logging.StreamHandler(sys.__stderr__)
+    writer.setFormatter(StructuredFormatter(logging.BASIC_FORMAT))
+    listener = QueueListener(records, writer, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(records))
+    root.setLevel(logging.WARNING)
+
+    for name, level in levels.items():
+        logging.getLogger(name or None).setLevel(level)
+
+    # Stray output should always be visible, whatever the root level.
+    loop_thread = threading.get_ident()
+    stdout_logger = logging.getLogger('stdout')
+    stdout_logger.setLevel(logging.INFO)
+    stderr_logger = logging.getLogger('stderr')
+    stderr_logger.setLevel(logging.INFO)
+    sys.stdout = LoopThreadStream(sys.stdout, stdout_logger, loop_thread)
+    sys.stderr = LoopThreadStream(sys.stderr, stderr_logger, loop_thread)
+
+    listener.start()
+    return listener
+
+
+def stop_logging(listener: QueueListener) -> None:
+    """Flush and stop the background writer, restoring stdout and stderr."""
+    listener.stop()
+    sys.stdout = sys.__stdout__
+    sys.stderr = sys.__stderr__
@@ -10,6 +10,7 @@ class Alliance(IntEnum):
 class FieldElement(IntEnum):
     SPEAKER = 0
     AMP = 1
+    DISPLAY = 2  # input-less; mirrors its alliance's amp and speaker
 
 class Message(ABC):
     "A message."
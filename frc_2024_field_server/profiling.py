@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
+import logging
+import re
+import sys
+import threading
+import time
+from typing import Final
+
+"""Profiling mode for diagnosing field lag.
+
+Combines a sampling profiler for the event loop thread with asyncio's slow
+callback detection. Produces two files:
+
+  <prefix>.folded: collapsed stacks, one "frame;frame;frame count" per line,
+    suitable for flamegraph.pl or speedscope.
+  <prefix>-stalls.txt: summary of event loop steps that overran the budget,
+    attributed to the coroutine that was running.
+"""
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL_SECS: Final = 0.005
+WORST_STALLS_REPORTED: Final = 20
+
+# Message logged by asyncio's base event loop in debug mode when a callback overruns.
+SLOW_CALLBACK_MSG: Final = 'Executing %s took %.3f seconds'
+
+CORO_NAME_RE: Final = re.compile(r'coro=<([\w.<>]+)\(')
+
+
+@dataclass
+class Stall:
+    """A single event loop step that overran the budget."""
+    source: str
+    duration_ms: float
+    at_ns: int
+
+
+class StallRecorder(logging.Filter):
+    """Collects asyncio slow-callback reports and attributes them to coroutines.
+
+    Installed as a filter on the asyncio logger, so it sees every report
+    whatever log level is configured; records below `min_level` are then
+    dropped as the configured level would have.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stalls: list[Stall] = []
+        self.min_level = logging.NOTSET
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        self._record_stall(record)
+        return record.levelno >= self.min_level
+
+    def _record_stall(self, record: logging.LogRecord) -> None:
+        if record.msg != SLOW_CALLBACK_MSG or not isinstance(record.args, tuple):
+            return
+        handle_desc, duration_secs = record.args
+        if not isinstance(duration_secs, (int, float)):
+            return
+        self.stalls.append(Stall(_source_name(str(handle_desc)), float(duration_secs) * 1000, time.monotonic_ns()))
+
+
+def _source_name(handle_desc: str) -> str:
+    """Extract the coroutine name from an asyncio handle description, if there is one."""
+    match = CORO_NAME_RE.search(handle_desc)
+    return match.group(1) if match else handle_desc
+
+
+class StackSampler:
+    """Periodically samples the stack of one thread from a background thread."""
+
+    def __init__(self, thread_id: int, interval_secs: float = SAMPLE_INTERVAL_SECS):
+        self._thread_id = thread_id
+        self._interval_secs = interval_secs
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.stacks: Counter[str] = Counter()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval_secs):
+            frame = sys._current_frames().get(self._thread_id)
+            names: list[str] = []
+            while frame is not None:
+                code = frame.f_code
+                # co_qualname is only available from Python 3.11
+                name = getattr(code, 'co_qualname', code.co_name)
+                names.append(f'{name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def write_folded(self, path: str) -> None:
+        """Write collapsed stacks for flame graph tools."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class Profiler:
+    """Whole-run profile of the event loop, written out when stopped."""
+
+    def __init__(self, output_prefix: str, budget_ms: float):
+        self._output_prefix = output_prefix
+        self._budget_ms = budget_ms
+        self._sampler = StackSampler(threading.get_ident())
+        self._recorder = StallRecorder()
+        self._asyncio_level = logging.NOTSET
+        self._start_ns = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start profiling. Must be called from the event loop thread."""
+        self._start_ns = time.monotonic_ns()
+        loop.set_debug(True)
+        loop.slow_callback_duration = self._budget_ms / 1000
+        # asyncio reports slow callbacks at WARNING; let them reach the recorder
+        # even if asyncio logging is turned down, without logging them.
+        asyncio_logger = logging.getLogger('asyncio')
+        self._asyncio_level = asyncio_logger.level
+        self._recorder.min_level = asyncio_logger.getEffectiveLevel()
+        asyncio_logger.addFilter(self._recorder)
+        asyncio_logger.setLevel(min(self._recorder.min_level, logging.WARNING))
+        self._sampler.start()
+        logger.info("Profiling; output will be written to %s.*", self._output_prefix)
+
+    def stop(self) -> None:
+        """Stop profiling and write results."""
+        self._sampler.stop()
+        asyncio_logger = logging.getLogger('asyncio')
+        asyncio_logger.removeFilter(self._recorder)
+        asyncio_logger.setLevel(self._asyncio_level)
+
+        folded_path = f'{self._output_prefix}.folded'
+        self._sampler.write_folded(folded_path)
+
+        stalls_path = f'{self._output_prefix}-stalls.txt'
+        summary = self.stall_summary()
+        with open(stalls_path, 'w') as f:
+            f.write(summary)
+
+        logger.info("Wrote %s and %s", folded_path, stalls_path)
+        logger.info("%s", summary)
+
+    def stall_summary(self) -> str:
+        """Summarize stalls, worst first, and totals by source."""
+        stalls = self._recorder.stalls
+        lines = [f'{len(stalls)} event loop steps over the {self._budget_ms:.0f}ms budget']
+        if not stalls:
+            return '\n'.join(lines) + '\n'
+
+        lines.append('')
+        lines.append('By source (count, total ms, worst ms):')
+        by_source: dict[str, list[float]] = {}
+        for stall in stalls:
+            by_source.setdefault(stall.source, []).append(stall.duration_ms)
+        for source, durations in sorted(by_source.items(), key=lambda item: -sum(item[1])):
+            lines.append(f'  {source}: {len(durations)}, {sum(durations):.1f}, {max(durations):.1f}')
+
+        lines.append('')
+        lines.append('Worst stalls:')
+        for stall in sorted(stalls, key=lambda s: -s.duration_ms)[:WORST_STALLS_REPORTED]:
+            lines.append(f'  {stall.duration_ms:8.1f}ms at +{(stall.at_ns - self._start_ns) / 1e9:.1f}s in {stall.source}')
+        return '\n'.join(lines) + '\n'
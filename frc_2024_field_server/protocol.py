@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import logging
+import string
+from frc_2024_field_server.logs import fields
+from typing import Final
+
+"""Wire protocol versions and framing.
+
+== v1 ==
+One two-character command per CRLF-terminated line in each direction.
+
+== v2 ==
+Negotiated at the handshake: the element appends '2' to its hello (e.g. 'HRA2'),
+and a v2-capable server answers 'OK2'. A server that only speaks v1 answers
+'OK', and the element falls back to v1.
+
+Server to element, several commands per frame:
+
+  F <seq: 2 hex digits> <count: 1 hex digit> <count two-character commands> CRLF
+
+  e.g. 'F1A3L1HBC0' is frame 0x1A carrying 'L1', 'HB' and 'C0'.
+
+Element to server, after applying a frame:
+
+  K <seq: 2 hex digits> [<element clock: 8 hex digits>] CRLF
+
+The element clock is its millis() when it sent the ack; the server uses it to
+estimate the element's clock offset (see clock.py). 'TS' is a command that
+elements ignore; the server sends it alone in a frame to get a fresh ack when
+it has sent nothing else for CLOCK_SYNC_PERIOD_NS.
+
+Sensor inputs may carry the element clock when the sensor tripped, so the
+server can score them at that time rather than when they arrived:
+
+  R <A or S> [<element clock: 8 hex digits>] CRLF
+
+  e.g. 'RA0001D4C0' is an amp note at millis() 0x1D4C0.
+
+Other element inputs ('A', 'C') are unchanged from v1.
+
+== Element index ==
+Elements beyond the standard four (e.g. extra displays) add a single-digit
+index after the version: 'HRA21' is red amp 1 on v2, 'HRA11' the same on v1.
+Displays use element letter 'D' ('HRD2', 'HRD21'); they have no inputs and are
+sent both their alliance's amp and speaker commands.
+
+Frames are printable ASCII rather than binary so they pass through the telnet
+layer (IAC escaping, CR handling, text decoding) unchanged.
+"""
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_V1: Final = 1
+PROTOCOL_V2: Final = 2
+
+FRAME_START: Final = 'F'
+ACK_START: Final = 'K'
+COMMAND_LENGTH: Final = 2
+MAX_FRAME_COMMANDS: Final = 15
+SEQUENCE_MODULUS: Final = 256
+
+CLOCK_SYNC_COMMAND: Final = 'TS'
+CLOCK_SYNC_PERIOD_NS: Final[int] = 1_000_000_000
+ELEMENT_CLOCK_DIGITS: Final = 8
+
+
+class ProtocolException(Exception):
+    """Input or output that does not fit the negotiated protocol."""
+
+
+def decode_protocol_version(hello: str) -> int:
+    """Protocol version requested by an element's hello line."""
+    return PROTOCOL_V2 if hello[3:4] == '2' else PROTOCOL_V1
+
+
+def handshake_response(version: int) -> str:
+    """Response accepting an element's hello at the given protocol version."""
+    return 'OK2' if version == PROTOCOL_V2 else 'OK'
+
+
+def encode_frame(sequence: int, commands: list[str]) -> str:
+    """Encode commands as one v2 frame, without CRLF."""
+    if not 0 < len(commands) <= MAX_FRAME_COMMANDS:
+        raise ProtocolException(f"Frame must carry 1 to {MAX_FRAME_COMMANDS} commands, not {len(commands)}")
+    for command in commands:
+        if len(command) != COMMAND_LENGTH:
+            raise ProtocolException(f"Command {command!r} is not {COMMAND_LENGTH} characters")
+    return f'{FRAME_START}{sequence:02X}{len(commands):X}{"".join(commands)}'
+
+
+def decode_ack(line: str) -> int:
+    """Decode the sequence number from a v2 ack line."""
+    try:
+        return int(line[1:3], 16)
+    except ValueError as e:
+        raise ProtocolException(f"Malformed ack {line!r}") from e
+
+
+def decode_ack_clock(line: str) -> int | None:
+    """Decode the element clock from a v2 ack line, if it has a well-formed one."""
+    return _decode_element_clock(line.rstrip(), 3)
+
+
+def decode_event_clock(line: str) -> int | None:
+    """Decode the element clock from a sensor input line, if it has a well-formed one."""
+    return _decode_element_clock(line.rstrip(), 2)
+
+
+def _decode_element_clock(line: str, start: int) -> int | None:
+    if len(line) != start + ELEMENT_CLOCK_DIGITS:
+        return None
+    digits = line[start:]
+    # A corrupted clock only costs the timestamp; the input is timed on arrival instead.
+    if not all(digit in string.hexdigits for digit in digits):
+        logger.warning("Ignoring malformed element clock", extra=fields(line=line))
+        return None
+    return int(digits, 16)
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+import mmap
+import multiprocessing
+import multiprocessing.synchronize
+import os
+import struct
+import time
+from frc_2024_field_server.game.modes import Mode
+from frc_2024_field_server.game.state import GameState
+from frc_2024_field_server.message_receiver import Alliance
+from typing import Final
+
+"""Game state export through a memory-mapped file, for local readers such as stream overlays.
+
+The file has a fixed layout, little-endian:
+
+  0:  b'FRCS' (magic)
+  4:  layout version, uint16
+  6:  reserved
+  8:  sequence, uint32: number of completed publishes
+  12: reserved
+  16: payload slot 0
+  68: payload slot 1
+
+Each payload slot is:
+
+  0:  cur_time_ns, mode_end_ns (int64), mode (uint8), 3 pad bytes
+  20: red alliance: score (int32), banked_notes (uint8), coopertition_offered (uint8),
+      2 pad bytes, amp_end_ns (int64)
+  36: blue alliance: same as red
+
+The payload is double-buffered: the writer fills slot (sequence + 1) % 2, then
+bumps the sequence. Readers read slot sequence % 2 and retry only if the
+sequence moved while they were reading, so a writer preempted mid-write never
+stalls them. Readers never take a lock or make a syscall.
+
+Times are time.monotonic_ns() values, which on Linux share a clock across
+processes, so readers can count timers down between server ticks themselves.
+"""
+
+DEFAULT_PATH: Final = '/dev/shm/frc-2024-field-state'
+
+MAGIC: Final = b'FRCS'
+LAYOUT_VERSION: Final = 1
+
+HEADER_FORMAT: Final = '<4sHxx'
+SEQUENCE_FORMAT: Final = '<I'
+SEQUENCE_OFFSET: Final = 8
+PAYLOAD_OFFSET: Final = 16
+GAME_FORMAT: Final = '<qqB3x'
+ALLIANCE_FORMAT: Final = '<iBBxxq'
+PAYLOAD_FORMAT: Final = GAME_FORMAT + ALLIANCE_FORMAT[1:] * len(Alliance)
+PAYLOAD_SIZE: Final = struct.calcsize(PAYLOAD_FORMAT)
+FILE_SIZE: Final = PAYLOAD_OFFSET + 2 * PAYLOAD_SIZE
+
+MAX_READ_ATTEMPTS: Final = 1000
+
+
+class SharedStateException(Exception):
+    """The shared state file is missing, malformed or could not be read consistently."""
+
+
+@dataclass
+class AllianceSnapshot:
+    score: int
+    banked_notes: int
+    coopertition_offered: bool
+    amp_end_ns: int
+
+    def get_remaining_amp_time_ns(self, when: int) -> int:
+        """Get remaining amp time at `when`, or 0 if amp is off."""
+        return 0 if (self.amp_end_ns == 0 or self.amp_end_ns < when) else self.amp_end_ns - when
+
+
+@dataclass
+class StateSnapshot:
+    """A consistent copy of the published game state."""
+    sequence: int
+    cur_time_ns: int
+    mode_end_ns: int
+    mode: Mode
+    alliances: tuple[AllianceSnapshot, AllianceSnapshot]
+
+    def get_remaining_time_ns(self, when: int) -> int:
+        """Remaining time in the current mode at `when` (a time.monotonic_ns() value), or 0."""
+        if self.mode_end_ns == 0 or when > self.mode_end_ns:
+            return 0
+        return self.mode_end_ns - when
+
+
+class SharedStatePublisher:
+    """Writes game state into the shared state file."""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self._path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, FILE_SIZE)
+            self._map = mmap.mmap(fd, FILE_SIZE)
+        finally:
+            os.close(fd)
+        self._sequence = 0
+        struct.pack_into(HEADER_FORMAT, self._map, 0, MAGIC, LAYOUT_VERSION)
+        struct.pack_into(SEQUENCE_FORMAT, self._map, SEQUENCE_OFFSET, self._sequence)
+
+    def publish(self, state: GameState) -> None:
+        """Publish the current state. Cheap enough to call every game tick."""
+        red = state.alliances[Alliance.RED]
+        blue = state.alliances[Alliance.BLUE]
+
+        sequence = (self._sequence + 1) & 0xFFFFFFFF
+        struct.pack_into(PAYLOAD_FORMAT, self._map, PAYLOAD_OFFSET + (sequence & 1) * PAYLOAD_SIZE,
+                         state.cur_time_ns, state.mode_end_ns, state.current_mode,
+                         red.score, red.banked_notes, red.coopertition_offered, red.amp_end_ns,
+                         blue.score, blue.banked_notes, blue.coopertition_offered, blue.amp_end_ns)
+        struct.pack_into(SEQUENCE_FORMAT, self._map, SEQUENCE_OFFSET, sequence)
+        self._sequence = sequence
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class SharedStateReader:
+    """Lock-free reader for the shared state file."""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError as e:
+            raise SharedStateException(f"No shared state at {path}; is the server running with --shared-state?") from e
+        try:
+            self._map = mmap.mmap(fd, FILE_SIZE, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+        magic, version = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            raise SharedStateException(f"Unexpected shared state layout {magic!r} v{version} in {path}")
+
+        self.retries = 0
+
+    def read(self) -> StateSnapshot:
+        """Read a consistent snapshot, retrying if the server published during the read."""
+        for _ in range(MAX_READ_ATTEMPTS):
+            (before,) = struct.unpack_from(SEQUENCE_FORMAT, self._map, SEQUENCE_OFFSET)
+            payload = struct.unpack_from(PAYLOAD_FORMAT, self._map, PAYLOAD_OFFSET + (before & 1) * PAYLOAD_SIZE)
+            (after,) = struct.unpack_from(SEQUENCE_FORMAT, self._map, SEQUENCE_OFFSET)
+            if before == after:
+                return _snapshot(before, payload)
+            self.retries += 1
+        raise SharedStateException("Unable to read a consistent snapshot; the writer is publishing too fast")
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def _snapshot(sequence: int, payload: tuple) -> StateSnapshot:
+    cur_time_ns, mode_end_ns, mode, *alliance_fields = payload
+    red = AllianceSnapshot(alliance_fields[0], alliance_fields[1], bool(alliance_fields[2]), alliance_fields[3])
+    blue = AllianceSnapshot(alliance_fields[4], alliance_fields[5], bool(alliance_fields[6]), alliance_fields[7])
+    return StateSnapshot(sequence, cur_time_ns, mode_end_ns, Mode(mode), (red, blue))
+
+
+def _benchmark_writer(path: str, period_secs: float, stop: multiprocessing.synchronize.Event) -> None:
+    """Publish synthetic, constantly-changing state until stopped."""
+    publisher = SharedStatePublisher(path)
+    state = GameState()
+    state.current_mode = Mode.TELEOP
+    while not stop.is_set():
+        state.cur_time_ns = time.monotonic_ns()
+        state.mode_end_ns = state.cur_time_ns + 1_000_000_000
+        for alliance in state.alliances:
+            alliance.score += 1
+        publisher.publish(state)
+        if period_secs:
+            time.sleep(period_secs)
+    publisher.close()
+
+
+def benchmark(path: str, seconds: float, period_secs: float) -> None:
+    """Measure read cost and snapshot age with a writer in another process."""
+    stop = multiprocessing.Event()
+    # Create the file up front so the reader doesn't race the writer process.
+    SharedStatePublisher(path).close()
+    writer = multiprocessing.Process(target=_benchmark_writer, args=(path, period_secs, stop))
+    writer.start()
+    try:
+        reader = SharedStateReader(path)
+        read_ns: list[int] = []
+        age_ns: list[int] = []
+        deadline = time.monotonic_ns() + int(seconds * 1e9)
+        while (start := time.monotonic_ns()) < deadline:
+            snapshot = reader.read()
+            end = time.monotonic_ns()
+            read_ns.append(end - start)
+            if snapshot.cur_time_ns:
+                age_ns.append(end - snapshot.cur_time_ns)
+    finally:
+        stop.set()
+        writer.join()
+
+    def percentiles(values: list[int]) -> str:
+        values.sort()
+        return ', '.join(f'p{p}={values[min(len(values) - 1, len(values) * p // 100)] / 1000:.1f}us'
+                         for p in (50, 99, 100))
+
+    print(f'{len(read_ns)} reads, {reader.retries} retries')
+    print(f'read cost: {percentiles(read_ns)}')
+    if age_ns:
+        print(f'snapshot age: {percentiles(age_ns)}')
+
+
+def run() -> None:
+    argparser = argparse.ArgumentParser(
+        prog='frc-2024-field-server-shared-state',
+        description='Benchmark the shared state export.',
+    )
+    argparser.add_argument('--path', default=f'{DEFAULT_PATH}-bench', help='Shared state file to use.')
+    argparser.add_argument('--seconds', default=5.0, type=float, help='How long to read for.')
+    argparser.add_argument('--period-msec', default=50.0, type=float,
+                           help='Writer publish period. Defaults to the game tick; lower it to stress contention.')
+    args = argparser.parse_args()
+    benchmark(args.path, args.seconds, args.period_msec / 1000)
+
+
+if __name__ == "__main__":
+    run()
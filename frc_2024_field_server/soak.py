@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+import gc
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from frc_2024_field_server.clients import Clients
+from frc_2024_field_server.game import actions
+from frc_2024_field_server.game.loop import game_loop, update_amp_timer, MAIN_PERIOD_MSEC
+from frc_2024_field_server.game.modes import Mode
+from frc_2024_field_server.game.state import GameState
+from frc_2024_field_server.message_receiver import Alliance
+from typing import Final
+import telnetlib3
+
+"""Soak test for connection churn.
+
+Runs the field server (without UI) in-process and drives many connect,
+handshake, traffic, disconnect cycles against it, tracking live tasks, traced
+memory and open file descriptors. Fails if resource use does not plateau, or if
+any alliance's live state stops matching a replay of its event log.
+
+Run with `python -m frc_2024_field_server.soak`.
+"""
+
+logger = logging.getLogger(__name__)
+
+HANDSHAKES: Final = ('HRA', 'HBA', 'HRS', 'HBS', 'HRA2', 'HBA2', 'HRS2', 'HBS2')
+AMP_TRAFFIC: Final = ('RA', 'RS', 'RA0001D4C0', 'RS0001D4C0', 'A', 'C')
+SPEAKER_TRAFFIC: Final = ('RA', 'RS', 'RA0001D4C0', 'RS0001D4C0')
+
+# Time allowed for server-side client teardown before measuring.
+SETTLE_TIMEOUT_SECS: Final = 5.0
+
+# Plateau thresholds, measured from the end of the first (warmup) batch to the end of the run.
+MAX_TASK_GROWTH: Final = 0
+MAX_FD_GROWTH: Final = 4
+MAX_BYTES_PER_CYCLE: Final = 16
+
+
+@dataclass
+class Sample:
+    """Resource use at one point in the soak."""
+    cycles: int
+    tasks: int
+    traced_bytes: int
+    fds: int | None
+
+
+def count_fds() -> int | None:
+    """Count open file descriptors, where the platform allows."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except FileNotFoundError:
+        return None
+
+
+async def run_cycle(host: str, port: int, rng: random.Random, messages_per_cycle: int) -> None:
+    """Connect, handshake, send traffic and disconnect once."""
+    handshake = rng.choice(HANDSHAKES)
+    traffic = AMP_TRAFFIC if handshake[2] == 'A' else SPEAKER_TRAFFIC
+
+    reader, writer = await telnetlib3.open_connection(host, port, connect_minwait=0, connect_maxwait=0.5)
+    try:
+        writer.write(f'{handshake}\r\n')
+        response = await asyncio.wait_for(reader.readline(), SETTLE_TIMEOUT_SECS)
+        if not response.startswith('OK'):
+            raise RuntimeError(f"Handshake {handshake} refused: {response!r}")
+
+        for _ in range(messages_per_cycle):
+            writer.write(f'{rng.choice(traffic)}\r\n')
+        await writer.drain()
+        await asyncio.sleep(0)
+    finally:
+        writer.close()
+
+
+async def start_match(state: GameState) -> None:
+    """End any match in progress and start a new one."""
+    while state.current_mode is not Mode.SETUP:
+        state.handle_go_button()
+    # Give the game loop a tick to stage the field.
+    await asyncio.sleep(2 * MAIN_PERIOD_MSEC / 1000)
+    state.handle_go_button()
+
+
+def check_replay(state: GameState) -> list[str]:
+    """Descriptions of each alliance whose live state doesn't match a replay of its event log."""
+    return [f"{alliance.name} state doesn't match a replay of its {len(state.logs[alliance].events)} events"
+            for alliance in Alliance if not state.logs[alliance].matches_replay(state.alliances[alliance])]
+
+
+async def check_late_amplified_note() -> list[str]:
+    """Score a speaker note that tripped just before its amp period ended but arrives after the
+    game loop showed the end; it must score amplified, live and on replay.
+
+    Return:
+      Descriptions of what went wrong; empty if nothing did.
+    """
+    state = GameState()
+    clients = Clients()
+    state.next_match_staged = True
+    state.handle_go_button()
+    state.cur_time_ns = time.monotonic_ns()
+
+    await actions.score_amp_note(state, clients, Alliance.RED)
+    await actions.score_amp_note(state, clients, Alliance.RED)
+    await actions.activate_amp(state, clients, Alliance.RED)
+    amp_end_ns = state.alliances[Alliance.RED].amp_end_ns
+
+    state.prev_time_ns = state.cur_time_ns
+    state.cur_time_ns = amp_end_ns + MAIN_PERIOD_MSEC * 1_000_000
+    await update_amp_timer(state, clients, Alliance.RED)
+    await actions.score_speaker_note(state, clients, Alliance.RED, amp_end_ns - 10_000_000)
+
+    failures = check_replay(state)
+    if state.alliances[Alliance.RED].stats.amplified_notes != 1:
+        failures.append("speaker note that tripped before the amp ended wasn't scored amplified")
+    return failures
+
+
+async def settle(baseline_tasks: int) -> None:
+    """Wait for server-side client tasks to wind down after a batch."""
+    deadline = time.monotonic() + SETTLE_TIMEOUT_SECS
+    while len(asyncio.all_tasks()) > baseline_tasks and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def sample(cycles: int) -> Sample:
+    gc.collect()
+    traced_bytes, _ = tracemalloc.get_traced_memory()
+    return Sample(cycles, len(asyncio.all_tasks()), traced_bytes, count_fds())
+
+
+def growth_per_cycle(samples: list[Sample]) -> float:
+    """Least-squares slope of traced memory against cycles, in bytes per cycle."""
+    if len(samples) < 2:
+        return 0.0
+    mean_cycles = sum(s.cycles for s in samples) / len(samples)
+    mean_bytes = sum(s.traced_bytes for s in samples) / len(samples)
+    covariance = sum((s.cycles - mean_cycles) * (s.traced_bytes - mean_bytes) for s in samples)
+    variance = sum((s.cycles - mean_cycles) ** 2 for s in samples)
+    return covariance / variance if variance else 0.0
+
+
+def check_plateau(samples: list[Sample]) -> list[str]:
+    """Compare resource use after warmup (the first sample) to the end of the run.
+
+    Return:
+      Descriptions of each resource that kept growing; empty if all plateaued.
+    """
+    warmup = samples[0]
+    final = samples[-1]
+    failures: list[str] = []
+
+    if final.tasks - warmup.tasks > MAX_TASK_GROWTH:
+        failures.append(f"live tasks grew from {warmup.tasks} to {final.tasks}")
+    if final.fds is not None and warmup.fds is not None and final.fds - warmup.fds > MAX_FD_GROWTH:
+        failures.append(f"open file descriptors grew from {warmup.fds} to {final.fds}")
+    bytes_per_cycle = growth_per_cycle(samples)
+    if bytes_per_cycle > MAX_BYTES_PER_CYCLE:
+        failures.append(f"traced memory grew from {warmup.traced_bytes} to {final.traced_bytes} bytes "
+                        f"({bytes_per_cycle:.1f} bytes/cycle)")
+    return failures
+
+
+async def soak(cycles: int, concurrency: int, samples: int, messages_per_cycle: int, seed: int) -> bool:
+    """Run the soak.
+
+    Return:
+      True if resource use plateaued and game state stayed consistent.
+    """
+    host = '127.0.0.1'
+    state = GameState()
+    clients = Clients()
+    game_task = asyncio.create_task(game_loop(state, clients), name='game_loop')
+    server = await telnetlib3.create_server(host, 0, shell=clients.new_connection_shell,
+                                            connect_maxwait=0.5, timeout=0)
+    port = server.sockets[0].getsockname()[1]
+    rng = random.Random(seed)
+    failures = await check_late_amplified_note()
+
+    baseline_tasks = len(asyncio.all_tasks())
+    batch = max(1, cycles // samples)
+    history: list[Sample] = []
+    done = 0
+
+    tracemalloc.start()
+    try:
+        while done < cycles:
+            # Run each batch in a fresh match, so traffic reaches game logic and the
+            # match's own record of it (its event logs) doesn't count as growth.
+            await start_match(state)
+
+            this_batch = min(batch, cycles - done)
+            pending = [this_batch // concurrency + (1 if i < this_batch % concurrency else 0)
+                       for i in range(concurrency)]
+
+            async def worker(count: int) -> None:
+                for _ in range(count):
+                    await run_cycle(host, port, rng, messages_per_cycle)
+
+            await asyncio.gather(*(worker(count) for count in pending))
+            done += this_batch
+            await settle(baseline_tasks)
+            failures += check_replay(state)
+
+            current = sample(done)
+            history.append(current)
+            logger.info("%d cycles: %d tasks, %d traced bytes, %s fds",
+                        current.cycles, current.tasks, current.traced_bytes, current.fds)
+    finally:
+        tracemalloc.stop()
+        server.close()
+        await server.wait_closed()
+        game_task.cancel()
+
+    for failure in failures:
+        logger.error("Game state check failed: %s", failure)
+
+    # The first batch is warmup: caches, interned strings and the like fill up there.
+    plateau_failures = check_plateau(history)
+    for failure in plateau_failures:
+        logger.error("Resource use did not plateau: %s", failure)
+    if not plateau_failures:
+        logger.info("Resource use plateaued over %d cycles.", done)
+    return not failures and not plateau_failures
+
+
+def run() -> None:
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    # Dropped connections are the point of the exercise; don't report each one.
+    for name in ('frc_2024_field_server.client', 'frc_2024_field_server.clients', 'telnetlib3', 'asyncio'):
+        logging.getLogger(name).setLevel(logging.CRITICAL)
+
+    argparser = argparse.ArgumentParser(
+        prog='frc-2024-field-server-soak',
+        description='Connection churn soak test for the field server.',
+    )
+    argparser.add_argument('--cycles', default=20_000, type=int, help='Connect/disconnect cycles to run.')
+    argparser.add_argument('--concurrency', default=8, type=int, help='Simultaneous client connections.')
+    argparser.add_argument('--samples', default=20, type=int, help='Number of resource samples to take.')
+    argparser.add_argument('--messages', default=5, type=int, help='Messages each client sends per cycle.')
+    argparser.add_argument('--seed', default=2024, type=int, help='Random seed for traffic.')
+    args = argparser.parse_args()
+
+    ok = asyncio.run(soak(args.cycles, args.concurrency, args.samples, args.messages, args.seed))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    run()
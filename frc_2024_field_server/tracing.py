@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from contextvars import ContextVar
+import json
+import logging
+from logging.handlers import QueueListener
+import queue
+import random
+import time
+from frc_2024_field_server.elements import ElementId
+from frc_2024_field_server.logs import LazyQueueHandler
+from typing import Final
+
+"""Sampled per-event latency tracing, from element input to field output.
+
+A sampled input line gets a Trace when it is read from the element. The trace
+rides along in the current context while the input is parsed, is attached to
+the ClientMessage while it waits for the game loop, and is current again while
+game logic runs, so every output queued during that time is recorded against
+it. The trace completes once all those outputs are drained to their sockets.
+
+Spans (all in ns):
+  parse: input line read -> message queued for the game loop
+  queue_wait: message queued -> game loop picked it up
+  game_logic: game loop picked it up -> game logic for it finished
+  output_queue_wait: output queued -> output task picked it up (worst output)
+  write: output task picked it up -> drained to the socket (worst output)
+
+Completed traces are written as JSON lines by a background thread.
+Unsampled inputs cost one random number and nothing else.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Trace for the input currently being handled, if it was sampled.
+current_trace: ContextVar[Trace | None] = ContextVar('current_trace', default=None)
+
+DEFAULT_TRACE_PATH: Final = 'field-traces.jsonl'
+
+
+class OutputSpan:
+    """One output caused by a traced input."""
+    __slots__ = ('trace', 'element', 'message', 'enqueued_ns', 'dequeued_ns', 'written_ns')
+
+    def __init__(self, trace: Trace, element: ElementId, message: str):
+        self.trace = trace
+        self.element = element
+        self.message = message
+        self.enqueued_ns = time.monotonic_ns()
+        self.dequeued_ns = 0
+        self.written_ns = 0
+
+    def mark_dequeued(self) -> None:
+        self.dequeued_ns = time.monotonic_ns()
+
+    def mark_written(self) -> None:
+        self.written_ns = time.monotonic_ns()
+        self.trace.output_written()
+
+
+class Trace:
+    """Timestamps for one input as it moves through the server."""
+    __slots__ = ('tracer', 'trace_id', 'element', 'input', 'received_ns', 'queued_ns', 'dequeued_ns',
+                 'logic_done_ns', 'outputs', '_pending_outputs')
+
+    def __init__(self, tracer: Tracer, trace_id: int, element: ElementId, inp: str, received_ns: int):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.element = element
+        self.input = inp.strip()
+        self.received_ns = received_ns
+        self.queued_ns = 0
+        self.dequeued_ns = 0
+        self.logic_done_ns = 0
+        self.outputs: list[OutputSpan] = []
+        self._pending_outputs = 0
+
+    def mark_queued(self) -> None:
+        self.queued_ns = time.monotonic_ns()
+
+    def mark_dequeued(self) -> None:
+        self.dequeued_ns = time.monotonic_ns()
+
+    def add_output(self, element: ElementId, message: str) -> OutputSpan:
+        span = OutputSpan(self, element, message)
+        self.outputs.append(span)
+        self._pending_outputs += 1
+        return span
+
+    def mark_logic_done(self) -> None:
+        self.logic_done_ns = time.monotonic_ns()
+        if self._pending_outputs == 0:
+            self.tracer.finish(self)
+
+    def output_written(self) -> None:
+        self._pending_outputs -= 1
+        if self._pending_outputs == 0 and self.logic_done_ns:
+            self.tracer.finish(self)
+
+    def spans(self) -> dict[str, int]:
+        """Span durations in ns. Output spans are the worst over all outputs."""
+        result = {
+            'parse': self.queued_ns - self.received_ns,
+            'queue_wait': self.dequeued_ns - self.queued_ns if self.dequeued_ns else 0,
+            'game_logic': self.logic_done_ns - self.dequeued_ns if self.dequeued_ns else 0,
+            'output_queue_wait': max((o.dequeued_ns - o.enqueued_ns for o in self.outputs), default=0),
+            'write': max((o.written_ns - o.dequeued_ns for o in self.outputs), default=0),
+        }
+        result['total'] = max([self.logic_done_ns] + [o.written_ns for o in self.outputs]) - self.received_ns
+        return result
+
+    def __str__(self) -> str:
+        # Formatted on the trace writer thread, not the event loop.
+        return json.dumps({
+            'id': self.trace_id,
+            'element': self.element.name,
+            'input': self.input,
+            'received_ns': self.received_ns,
+            'spans_ns': self.spans(),
+            'outputs': [{'element': o.element.name, 'message': o.message,
+                         'queue_wait_ns': o.dequeued_ns - o.enqueued_ns,
+                         'write_ns': o.written_ns - o.dequeued_ns} for o in self.outputs],
+        })
+
+
+class Tracer:
+    """Samples inputs for tracing and exports completed traces."""
+
+    def __init__(self, sample_rate: float, path: str = DEFAULT_TRACE_PATH):
+        self._sample_rate = sample_rate
+        self._next_id = 0
+        self._records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._listener = QueueListener(self._records, handler)
+        self._export = logging.getLogger(f'{__name__}.export')
+        self._export.propagate = False
+        self._export.setLevel(logging.INFO)
+        self._export.addHandler(LazyQueueHandler(self._records))
+        self._path = path
+        self.completed = 0
+
+    def start(self) -> None:
+        self._listener.start()
+        logger.info("Tracing %.1f%% of inputs to %s", self._sample_rate * 100, self._path)
+
+    def stop(self) -> None:
+        self._listener.stop()
+
+    def sample(self, element: ElementId, inp: str) -> Trace | None:
+        """Start a trace for an input just read, if it is sampled."""
+        if random.random() >= self._sample_rate:
+            return None
+        received_ns = time.monotonic_ns()
+        self._next_id += 1
+        return Trace(self, self._next_id, element, inp, received_ns)
+
+    def finish(self, trace: Trace) -> None:
+        """Export a completed trace."""
+        self.completed += 1
+        self._export.info('%s', trace)
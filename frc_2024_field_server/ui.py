@@ -6,10 +6,13 @@ from tkinter import ttk
 from tkinter.font import Font
 from frc_2024_field_server.clients import Clients
 from frc_2024_field_server.client import Client
+from frc_2024_field_server.elements import ElementId
 from frc_2024_field_server.message_receiver import Alliance, FieldElement
 from frc_2024_field_server.game.constants import TELEOP_PERIOD_NS, COOPERTITION_WINDOW_NS
+from frc_2024_field_server.game.events import EventKind
 from frc_2024_field_server.game.modes import Mode
-from frc_2024_field_server.game.state import GameState
+from frc_2024_field_server.game.state import AllianceLog, GameState
+from frc_2024_field_server.game.stats import ScoringStats
 from typing import Final
 
 MODE_TO_NAME: Final = {
@@ -19,6 +22,13 @@ MODE_TO_NAME: Final = {
     Mode.TELEOP: 'Teleop',
 }
 
+EVENT_KIND_TO_NAME: Final = {
+    EventKind.AMP_NOTE: 'amp note',
+    EventKind.SPEAKER_NOTE: 'speaker note',
+    EventKind.AMP_BUTTON: 'amp activation',
+    EventKind.COOPERTITION_BUTTON: 'coopertition offer',
+}
+
 class UI:
     def __init__(self, clients: Clients, state: GameState):
         self._clients = clients
@@ -30,10 +40,15 @@ class UI:
         self._root.grid_rowconfigure(0, weight=1)
         # TODO: root should not be closeable
         self._root.bind("<space>", self.handle_keypress)
+        # Referee corrections: void the alliance's latest scoring event. Behind
+        # Ctrl so a stray keystroke can't void anything.
+        self._root.bind("<Control-b>", lambda _: self._void_last_event(Alliance.BLUE))
+        self._root.bind("<Control-r>", lambda _: self._void_last_event(Alliance.RED))
 
         # Setup fonts
         self._category_font = Font(size=24)
         self._score_font = Font(size=48)
+        self._stats_font = Font(size=14)
 
         # setup styles
         self._styles = [
@@ -93,6 +108,16 @@ class UI:
         self._red_coopertition_status_label = ttk.Label(self._scores, padding=5, text="Available", font=self._category_font, justify="center")
         self._red_coopertition_status_label.grid(row=7, column=1)
 
+        self._blue_stats_label = ttk.Label(self._scores, padding=5, text="", font=self._stats_font, justify="center")
+        self._blue_stats_label.grid(row=8, column=0)
+        self._red_stats_label = ttk.Label(self._scores, padding=5, text="", font=self._stats_font, justify="center")
+        self._red_stats_label.grid(row=8, column=1)
+
+        self._blue_last_event_label = ttk.Label(self._scores, padding=5, text="", font=self._stats_font, justify="center")
+        self._blue_last_event_label.grid(row=9, column=0)
+        self._red_last_event_label = ttk.Label(self._scores, padding=5, text="", font=self._stats_font, justify="center")
+        self._red_last_event_label.grid(row=9, column=1)
+
         time_frame = ttk.Frame(self._topframe, padding=5)
         time_frame.grid(row=2, column=0, sticky="wes")
         time_frame.grid_columnconfigure(0, weight=1)
@@ -103,10 +128,20 @@ class UI:
         self._time_count_label = ttk.Label(time_frame, padding=5, text="0.0", font=self._score_font, justify="center")
         self._time_count_label.grid(row=1, column=0)
 
+        self._match_label = ttk.Label(time_frame, padding=5, text="Match 1: staging", font=self._category_font, justify="center")
+        self._match_label.grid(row=2, column=0)
+
 
     def handle_keypress(self, _)-> None:
         """Handle a keypress event in the UI."""
-        self._state.handle_go_button()
+        self._state.handle_go_button(self._clients.all_in_sync())
+
+
+    def _void_last_event(self, alliance: Alliance) -> None:
+        """Void an alliance's latest event that is in effect."""
+        event = self._state.logs[alliance].last_voidable()
+        if event is not None:
+            self._state.void_event(alliance, event)
 
 
     def _init_connection(self, parent: ttk.Frame, row: int, column: int, label: str) -> ttk.Label:
@@ -144,7 +179,10 @@ class UI:
             self._update_scores(self._state)
             self._update_amps(self._state)
             self._update_coopertition(self._state)
+            self._update_stats(self._state)
+            self._update_last_events(self._state)
             self._update_mode_and_time(self._state)
+            self._update_match(self._state, self._clients)
 
             self._root.update()
             await asyncio.sleep(0)
@@ -152,10 +190,10 @@ class UI:
 
     def _update_connection_states(self, clients: Clients) -> None:
         """Update connection display."""
-        self._update_connection_state(self._red_speaker_connection, clients.clients[Alliance.RED][FieldElement.SPEAKER])
-        self._update_connection_state(self._blue_speaker_connection, clients.clients[Alliance.BLUE][FieldElement.SPEAKER])
-        self._update_connection_state(self._red_amp_connection, clients.clients[Alliance.RED][FieldElement.AMP])
-        self._update_connection_state(self._blue_amp_connection, clients.clients[Alliance.BLUE][FieldElement.AMP])
+        self._update_connection_state(self._red_speaker_connection, clients.get(ElementId(Alliance.RED, FieldElement.SPEAKER)))
+        self._update_connection_state(self._blue_speaker_connection, clients.get(ElementId(Alliance.BLUE, FieldElement.SPEAKER)))
+        self._update_connection_state(self._red_amp_connection, clients.get(ElementId(Alliance.RED, FieldElement.AMP)))
+        self._update_connection_state(self._blue_amp_connection, clients.get(ElementId(Alliance.BLUE, FieldElement.AMP)))
 
     def _update_connection_state(self, label: ttk.Label, client: Client | None):
         """Set the color of a connection label based on connection status."""
@@ -171,8 +209,8 @@ class UI:
         self._blue_banked_notes_count_label.config(text=state.alliances[Alliance.BLUE].banked_notes)
         self._red_banked_notes_count_label.config(text=state.alliances[Alliance.RED].banked_notes)
 
-        self._blue_amp_status_label.config(text="Amp off" if state.alliances[Alliance.BLUE].amp_end_ns==0 else "Amp on")
-        self._red_amp_status_label.config(text="Amp off" if state.alliances[Alliance.RED].amp_end_ns==0 else "Amp on")
+        self._blue_amp_status_label.config(text="Amp on" if state.alliances[Alliance.BLUE].amp_active(state.cur_time_ns) else "Amp off")
+        self._red_amp_status_label.config(text="Amp on" if state.alliances[Alliance.RED].amp_active(state.cur_time_ns) else "Amp off")
 
         blue_amp_time_ns = state.alliances[Alliance.BLUE].get_remaining_amp_time_ns(state.cur_time_ns)
         red_amp_time_ns = state.alliances[Alliance.RED].get_remaining_amp_time_ns(state.cur_time_ns)
@@ -195,6 +233,33 @@ class UI:
         self._blue_coopertition_status_label.config(text="Offered" if state.alliances[Alliance.BLUE].coopertition_offered else "Available")
         self._red_coopertition_status_label.config(text="Offered" if state.alliances[Alliance.RED].coopertition_offered else "Available")
 
+    def _update_stats(self, state: GameState) -> None:
+        """Update the scoring breakdown displays."""
+        self._blue_stats_label.config(text=self._format_stats(state.alliances[Alliance.BLUE].stats, state.cur_time_ns))
+        self._red_stats_label.config(text=self._format_stats(state.alliances[Alliance.RED].stats, state.cur_time_ns))
+
+    def _format_stats(self, stats: ScoringStats, cur_time_ns: int) -> str:
+        """Format one alliance's scoring breakdown."""
+        return (f"Amp {stats.amp_points} | Speaker {stats.speaker_points}\n"
+                f"Notes: {stats.amp_notes} amp, {stats.amplified_notes} amplified, {stats.unamplified_notes} unamplified\n"
+                f"Auto {stats.points_by_mode[Mode.AUTONOMOUS] + stats.points_by_mode[Mode.WAIT_FOR_TELEOP]} | "
+                f"Teleop {stats.points_by_mode[Mode.TELEOP] + stats.points_by_mode[Mode.SETUP]}\n"
+                f"Last 10s: {stats.recent_points_per_sec(cur_time_ns):.1f} pts/s")
+
+    def _update_last_events(self, state: GameState) -> None:
+        """Update the displays of each alliance's latest voidable event."""
+        self._blue_last_event_label.config(text=self._format_last_event(state.logs[Alliance.BLUE], "Ctrl+B"))
+        self._red_last_event_label.config(text=self._format_last_event(state.logs[Alliance.RED], "Ctrl+R"))
+
+    def _format_last_event(self, log: AllianceLog, key: str) -> str:
+        """Describe an alliance's latest voidable event and how to void it."""
+        event = log.last_voidable()
+        if event is None:
+            return ""
+        voided_count = sum(log.voided)
+        voided = f", {voided_count} voided" if voided_count else ""
+        return f"Last: {EVENT_KIND_TO_NAME[event.kind]} in {MODE_TO_NAME[event.mode]} ({key} voids{voided})"
+
     def _update_mode_and_time(self, state: GameState) -> None:
         """Update the current time remaining and the current game mode."""
         self._time_mode_label.config(text=MODE_TO_NAME[state.current_mode])
@@ -203,3 +268,18 @@ class UI:
         remaining_time_secs = round(remaining_time_ns / 1e9 ,1)
         self._time_count_label.config(text=remaining_time_secs)
 
+
+    def _update_match(self, state: GameState, clients: Clients) -> None:
+        """Update the match number and readiness of the field for the next match."""
+        if state.current_mode is not Mode.SETUP:
+            self._match_label.config(text=f"Match {state.match_number}")
+            return
+
+        if state.ready_to_start(clients.all_in_sync()):
+            status = "ready"
+        elif state.next_match_staged:
+            status = "waiting for elements"
+        else:
+            status = "staging"
+        turnaround = f" (last turnaround {state.last_turnaround_ns / 1e9:.0f}s)" if state.last_turnaround_ns else ""
+        self._match_label.config(text=f"Match {state.match_number + 1}: {status}{turnaround}")